@@ -1,4 +1,5 @@
 from jq import jq
+import functools
 import json
 import publicsuffix2
 import urllib
@@ -12,14 +13,25 @@ def load_json_file(json_filename):
     return data
 
 
+@functools.lru_cache(maxsize=None)
+def jq_program(query):
+    # compile every jq query only once, the compiled program can be reused for any input
+    return jq(query)
+
+
 def jq_one(data, query):
     # retrieve data from the json data using a jq query
-    return jq(query).input_value(data).first()
+    return jq_program(query).input_value(data).first()
 
 
 def jq_all(data, query):
     # retrieve data from the json data using a jq query
-    return jq(query).input_value(data).all()
+    return jq_program(query).input_value(data).all()
+
+
+def header_values(headers, name):
+    # the values of all headers with the given name, without going through jq again
+    return [header['value'] for header in headers if header['name'] == name]
 
 
 def url_to_domain(url):
@@ -91,11 +103,11 @@ def compute_tracker_cookie_domains(data):
 
     for response_with_cookies in responses_with_cookies:
         # extract the date from the response
-        raw_response_date = jq_one(response_with_cookies, '.[] | select(.name == "date") | .value')
+        raw_response_date = header_values(response_with_cookies, 'date')[0]
         response_date = email.utils.parsedate_to_datetime(raw_response_date)
 
         # extract the cookies from the response
-        raw_cookies = jq_all(response_with_cookies, '.[] | select(.name == "set-cookie") | .value')
+        raw_cookies = header_values(response_with_cookies, 'set-cookie')
 
         for raw_cookie in raw_cookies:
             # load the raw cookie data into a cookie object
@@ -120,20 +132,20 @@ def compute_third_party_entities(data, domain_map, third_party_domains):
 
 def compute_requests(data, domain_map, first_party_domain):
     # compute all the requests and responses data
-    requests_and_responses = jq_all(data, '.log.entries.[]')
+    requests_and_responses = data['log']['entries']
     all_results = []
 
     for request_and_response in requests_and_responses:
         results = {}
 
-        url = jq_one(request_and_response, '.request.url')
+        url = request_and_response['request']['url']
         domain = url_to_domain(url)
 
         results['url_first_128_char'] = url[:128]
         results['url_domain'] = domain
         results['is_third_party'] = domain != first_party_domain
-        results['set_http_cookies'] = len(jq_all(request_and_response,
-            '.response.headers.[] | select(.name == "set-cookie")')) > 0
+        results['set_http_cookies'] = len(header_values(
+            request_and_response['response']['headers'], 'set-cookie')) > 0
         results['entity_name'] = get_entityname(domain_map, domain)
 
         all_results.append(results)
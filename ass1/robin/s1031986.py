@@ -9,10 +9,15 @@
 # Imports
 from tld import get_fld
 import json
+import os
+import sys
 from datetime import datetime, timedelta, timezone
 from http.cookies import SimpleCookie
 from dateutil import parser
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'utils'))
+from entity_resolver import load_entity_resolver
+
 def get_urls_from_entries(data):
     urls = set()
     for entry in data['log']['entries']:
@@ -107,20 +112,16 @@ def get_tracker_cookie_domains(data):
 
 def get_third_party_entities(data):
     third_party_domains = get_third_parties(data)
-    third_party_entities = set()
-    with open('domain_map.json', 'r', encoding='utf-8') as f:
-        domain_map = json.load(f)
-    
-    for domain in third_party_domains:
-        if domain in domain_map:
-            entity_name = domain_map[domain]["entityName"]
-            entity_name = entity_name.replace('\\"', '"')
-            third_party_entities.add(entity_name)
+    resolver = load_entity_resolver('domain_map.json')
+    third_party_entities = set(resolver.resolve(third_party_domains))
+    third_party_entities.discard(None)
 
     return third_party_entities
 
 
 def get_request(data):
+    # The domain map is only loaded once, lookups are memoised by the resolver
+    resolver = load_entity_resolver('domain_map.json')
     request_list = list()
     for entry in data['log']['entries']:
         # building first level key
@@ -151,17 +152,7 @@ def get_request(data):
         requests['requests']['set_http_cookies'] = set_http_cookies
 
         # entity_name
-        with open('domain_map.json', 'r', encoding='utf-8') as f:
-            domain_map = json.load(f)
-
-        # This implementation is kinda slow...
-        found_entity_name = False
-        if domain in domain_map:
-            entity_name = domain_map[domain]["entityName"]
-            entity_name = entity_name.replace('\\"', '"')
-            requests['requests']['entity_name'] = entity_name
-        else:
-            requests['requests']['entity_name'] = 'unknown'
+        requests['requests']['entity_name'] = resolver.entity_of(domain, 'unknown')
             
         request_list.append(requests)
     
@@ -0,0 +1,248 @@
+# Throughput and memory benchmarks of the analysis code on synthetic HAR files.
+#
+# Every analysis of the notebook (utils/har_analysis.py), the assignment 1
+# scripts and notebook and the replacement engines in utils/ is run over the
+# same seeded corpus from har_synth.py, reporting entries per second and peak
+# memory.
+#
+# python bench_analysis.py --sites 200 --entries 50-500
+# python bench_analysis.py --save baseline.json
+# python bench_analysis.py --baseline baseline.json   (exits with 1 on a regression)
+
+import argparse
+import importlib.util
+import json
+import logging as log
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'utils'))
+
+import domains
+import har_analysis
+import har_diff
+import har_report
+import redirect_graph
+from entity_resolver import EntityResolver, load_entity_resolver
+from har_synth import HarGenerator, parse_entries_range
+
+
+def load_script(name, path):
+    # The assignment 1 scripts are not modules, and may need packages that are not installed
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_notebook(name, path, skip=()):
+    # Run the code cells of a notebook, except the ones in skip, as a module.
+    # main() is not called, the module is not __main__.
+    with open(path, 'r', encoding='utf-8') as file:
+        cells = json.load(file)['cells']
+
+    module = types.ModuleType(name)
+    module.__file__ = path
+    for index, cell in enumerate(cells):
+        if cell['cell_type'] == 'code' and index not in skip:
+            exec(compile(''.join(cell['source']), f'{path}[{index}]', 'exec'), module.__dict__)
+    return module
+
+
+def first_party(har):
+    return har_report.first_party_of(har, '')
+
+
+def notebook_benchmarks(disconnect_domains):
+    return [
+        ('notebook', 'count_requests', har_analysis.count_requests),
+        ('notebook', 'count_third_party', har_analysis.count_third_party),
+        ('notebook', 'count_tracker_domains', lambda hars: har_analysis.count_tracker_domains(hars, disconnect_domains)),
+        ('notebook', 'count_same_site', har_analysis.count_same_site),
+        ('notebook', 'prevalent_third_party', lambda hars: har_analysis.prevalent_third_party(hars, disconnect_domains)),
+        ('notebook', 'frequency_methods', har_analysis.frequency_methods),
+        ('notebook', 'analyze_permissions', har_analysis.analyze_permissions),
+        ('notebook', 'analyze_referrer_policy', har_analysis.analyze_referrer_policy),
+        ('notebook', 'analyze_client_hints', har_analysis.analyze_client_hints),
+        ('notebook', 'analyze_redirections', har_analysis.analyze_redirections),
+        ('approximate', 'count_third_party', lambda hars: har_analysis.count_third_party(hars, approximate=True)),
+        ('approximate', 'prevalent_third_party', lambda hars: har_analysis.prevalent_third_party(
+            hars, disconnect_domains, approximate=True)),
+        ('approximate', 'count_distinct_third_party', lambda hars: har_analysis.count_distinct_third_party(
+            hars, approximate=True)),
+    ]
+
+
+def ass1_benchmarks():
+    # Run from the corpus directory, both scripts read domain_map.json from the working directory
+    benchmarks = []
+
+    try:
+        robin = load_script('s1031986', os.path.join(ROOT, 'ass1', 'robin', 's1031986.py'))
+    except ImportError as e:
+        log.warning(f"Skipping ass1/robin: {e}")
+    else:
+        benchmarks.append(('ass1', 'robin', lambda hars: [
+            robin.generate_json_results(har, os.devnull) for har in hars
+        ]))
+
+    try:
+        bram = load_script('s1015194', os.path.join(ROOT, 'ass1', 'bram', 's1015194.py'))
+    except ImportError as e:
+        log.warning(f"Skipping ass1/bram: {e}")
+    else:
+        domain_map = bram.load_json_file('domain_map.json')
+        benchmarks.append(('ass1', 'bram', lambda hars: [
+            bram.compute_results(har, domain_map, first_party(har)) for har in hars
+        ]))
+
+    try:
+        # Cell 9 pip installs tldextract when it is missing
+        sabah = load_notebook('s1124043', os.path.join(ROOT, 'ass1', 'sabah', 's1124043.ipynb'), skip=(9,))
+    except ImportError as e:
+        log.warning(f"Skipping ass1/sabah: {e}")
+    else:
+        entity_map = sabah.load_file('domain_map.json')
+        benchmarks.append(('ass1', 'sabah', lambda hars: [
+            (sabah.analyze_har_file(har, entity_map), sabah.extract_requests_details_from_har(har, entity_map))
+            for har in hars
+        ]))
+
+    return benchmarks
+
+
+def engine_benchmarks(resolver):
+    return [
+        ('engine', 'har_report', lambda hars: [
+            har_report.compute_report(har, first_party(har), resolver) for har in hars
+        ]),
+        ('engine', 'har_diff', lambda hars: [
+            har_diff.capture_sets(har, first_party(har), 'url') for har in hars
+        ]),
+        ('engine', 'redirect_graph', redirect_graph.build_redirect_graph),
+    ]
+
+
+def reset_caches(resolver):
+    # Every benchmark starts without memoised domains. The ass1/robin script
+    # uses the per-process resolver of the corpus' domain_map.json (the
+    # working directory), which keeps its own memo.
+    domains.registered_domain_of_host.cache_clear()
+    resolver.clear_cache()
+    load_entity_resolver('domain_map.json').clear_cache()
+
+
+def measure(func, hars, repeat, resolver):
+    seconds = float('inf')
+    for _ in range(repeat):
+        reset_caches(resolver)
+        start_time = time.perf_counter()
+        func(hars)
+        seconds = min(seconds, time.perf_counter() - start_time)
+
+    # Separate run for the memory, tracemalloc slows everything down
+    reset_caches(resolver)
+    tracemalloc.start()
+    func(hars)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Returns the names of the benchmarks that got slower or use more memory than allowed
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]
+        if result['entries_per_sec'] < before['entries_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {before['entries_per_sec']:.0f} -> {result['entries_per_sec']:.0f} entries/s")
+        if result['peak_mb'] > before['peak_mb'] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: {before['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB peak")
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the HAR analysis code on synthetic data')
+    parser.add_argument('--sites', metavar='N', type=int, default=100, help='Number of synthetic sites')
+    parser.add_argument('--entries', metavar='MIN[-MAX]', type=parse_entries_range, default=(50, 500),
+                        help='Number of entries per HAR file')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+    parser.add_argument('--repeat', metavar='N', type=int, default=3, help='Timed runs per benchmark, the best one counts')
+    parser.add_argument('--only', metavar='GROUP', action='append', help='Only run this group (notebook, approximate, ass1, engine)')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='Fail if slower or bigger than these saved results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    generator = HarGenerator(args.seed)
+    hars = [
+        generator.generate_har(site_index, generator.num_entries(site_index, args.entries), 'allow')
+        for site_index in range(args.sites)
+    ]
+    num_entries = sum(len(har['log']['entries']) for har in hars)
+    log.info(f"Generated {len(hars)} HAR files with {num_entries} entries")
+
+    resolver = EntityResolver.from_domain_map(generator.domain_map())
+    disconnect_domains = har_analysis.load_block_list()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        with open(os.path.join(corpus_dir, 'domain_map.json'), 'w', encoding='utf-8') as file:
+            json.dump(generator.domain_map(), file)
+
+        cwd = os.getcwd()
+        os.chdir(corpus_dir)
+        try:
+            benchmarks = notebook_benchmarks(disconnect_domains) + ass1_benchmarks() + engine_benchmarks(resolver)
+            print(f"{'benchmark':<36}{'entries/s':>14}{'seconds':>10}{'peak MB':>10}")
+            for group, name, func in benchmarks:
+                if args.only and group not in args.only:
+                    continue
+                seconds, peak = measure(func, hars, args.repeat, resolver)
+                result = {
+                    'entries_per_sec': num_entries / seconds if seconds > 0 else float('inf'),
+                    'seconds': seconds,
+                    'peak_mb': peak / 2 ** 20,
+                }
+                results[f'{group}/{name}'] = result
+                print(f"{group + '/' + name:<36}{result['entries_per_sec']:>14.0f}{seconds:>10.3f}{result['peak_mb']:>10.1f}")
+        finally:
+            os.chdir(cwd)
+
+    corpus = {'sites': args.sites, 'entries': list(args.entries), 'seed': args.seed, 'num_entries': num_entries}
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump({'corpus': corpus, 'results': results}, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('corpus') != corpus:
+            log.warning("The baseline was measured on a different corpus")
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            log.error(f"Regression in {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# Startup time of the crawler and the analysis entry points.
+#
+# Every target is run in a fresh interpreter, the best of --repeat runs
+# counts. The targets must not load any of the heavy modules below (they
+# are imported lazily, when first used), a target that does fails the run.
+#
+# python bench_startup.py
+# python bench_startup.py --save startup.json
+# python bench_startup.py --baseline startup.json   (exits with 1 on a regression)
+
+import argparse
+import json
+import logging as log
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CRAWLER_DIR = os.path.join(ROOT, 'crawler_src')
+UTILS_DIR = os.path.join(ROOT, 'utils')
+NOTEBOOK_PATH = os.path.join(ROOT, 'analysis', 'analysis.ipynb')
+
+# Submodules that are only in sys.modules once their package has really been
+# imported (a lazy module is in sys.modules before it is loaded)
+HEAVY_MODULES = {
+    'playwright': 'playwright.sync_api',
+    'tld': 'tld.utils',
+    'tqdm': 'tqdm.std',
+    'tldextract': 'tldextract.tldextract',
+    'pandas': 'pandas.core',
+    'seaborn': 'seaborn.axisgrid',
+    'PIL': 'PIL.Image',
+}
+
+# The notebook cells that set up the imports
+NOTEBOOK_SETUP_CELLS = (1, 2)
+
+REPORT_LOADED = f'''
+import json as _json, sys as _sys
+print(_json.dumps(sorted(name for name, sub in {HEAVY_MODULES!r}.items() if sub in _sys.modules)))
+'''
+
+
+def missing_optional_module(stderr, optional):
+    # The optional module whose absence made a target fail, or None for any other failure
+    lines = stderr.strip().splitlines()
+    match = re.match(r"ModuleNotFoundError: No module named '([\w.]+)'", lines[-1]) if lines else None
+    if match and match.group(1).split('.')[0] in optional:
+        return match.group(1)
+    return None
+
+
+def notebook_setup_code():
+    with open(NOTEBOOK_PATH, 'r', encoding='utf-8') as file:
+        cells = json.load(file)['cells']
+    return '\n'.join(''.join(cells[index]['source']) for index in NOTEBOOK_SETUP_CELLS)
+
+
+def targets():
+    # name -> (code, working directory, heavy modules it may fail without).
+    # Only the notebook looks its lazy modules up at startup; the others
+    # must start without any heavy module installed.
+    return {
+        'python': ('pass', ROOT, ()),
+        'crawl': (f'import sys; sys.path.insert(0, {CRAWLER_DIR!r}); import crawl', CRAWLER_DIR, ()),
+        'crawl --help': (
+            f'import sys; sys.argv = ["crawl.py", "--help"]; sys.path.insert(0, {CRAWLER_DIR!r})\n'
+            'import crawl\n'
+            'try:\n'
+            '    crawl.parse_arguments()\n'
+            'except SystemExit:\n'
+            '    pass',
+            CRAWLER_DIR,
+            (),
+        ),
+        'har_analysis': (f'import sys; sys.path.insert(0, {UTILS_DIR!r}); import har_analysis', UTILS_DIR, ()),
+        'notebook setup': (notebook_setup_code(), os.path.join(ROOT, 'analysis'), ('pandas', 'seaborn')),
+    }
+
+
+def run_target(code, cwd):
+    # Returns (seconds, loaded heavy modules), or raises CalledProcessError
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', code + '\n' + REPORT_LOADED],
+        cwd=cwd, capture_output=True, text=True, check=True
+    )
+    seconds = time.perf_counter() - start_time
+    return seconds, json.loads(result.stdout.splitlines()[-1])
+
+
+def measure(code, cwd, repeat):
+    seconds = float('inf')
+    loaded = []
+    for _ in range(repeat):
+        run_seconds, loaded = run_target(code, cwd)
+        seconds = min(seconds, run_seconds)
+    return seconds, loaded
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Returns the targets that start slower than allowed, relative to the bare interpreter
+    regressions = []
+    for name, result in results.items():
+        if name == 'python' or name not in baseline:
+            continue
+        before = baseline[name]['overhead_ms']
+        if result['overhead_ms'] > before * (1 + tolerance) + 5:
+            regressions.append(f"{name}: {before:.0f} -> {result['overhead_ms']:.0f} ms")
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the crawler and the analysis')
+    parser.add_argument('--repeat', metavar='N', type=int, default=5, help='Runs per target, the best one counts')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='Fail if slower than these saved results')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative regression')
+
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    results = {}
+    failures = []
+    python_seconds = 0
+    print(f"{'target':<20}{'ms':>10}{'overhead ms':>14}  heavy modules loaded")
+    for name, (code, cwd, optional) in targets().items():
+        try:
+            seconds, loaded = measure(code, cwd, args.repeat)
+        except subprocess.CalledProcessError as e:
+            # A missing optional dependency is not a startup regression, anything else is
+            missing = missing_optional_module(e.stderr, optional)
+            if missing is not None:
+                log.warning(f"Skipping {name}: {missing} is not installed")
+            else:
+                failures.append(f"{name} fails to start:\n{e.stderr.strip()}")
+            continue
+
+        if name == 'python':
+            python_seconds = seconds
+        results[name] = {'ms': seconds * 1000, 'overhead_ms': (seconds - python_seconds) * 1000, 'loaded': loaded}
+        print(f"{name:<20}{seconds * 1000:>10.1f}{results[name]['overhead_ms']:>14.1f}  {', '.join(loaded) or '-'}")
+        if loaded:
+            failures.append(f"{name} loads {', '.join(loaded)} at startup")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            failures.extend(compare_to_baseline(results, json.load(file), args.tolerance))
+
+    for failure in failures:
+        log.error(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
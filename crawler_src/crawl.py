@@ -1,43 +1,36 @@
-from playwright.sync_api import sync_playwright
-from tld import get_fld
-import tqdm, tqdm.contrib.logging
+# Playwright, tld and tqdm are imported where they are first needed, so quick
+# runs (--help, a single -u url) and worker processes start fast
 import argparse
+import functools
 import os
 import json
+import random
 import time
 import logging as log
 import datetime
+import glob
+import shutil
+import sys
+import tempfile
 
-
-class StatisticsCrawler:
-    # To keep track of the statistics for the analysis
-
-    def __init__(self):
-        self.stats = {
-            "consent_click_failure_allow": set(),
-            "consent_click_failure_block": set(),
-
-            "page_load_timeout_allow":  set(),
-            "page_load_timeout_block":  set(),
-
-            "page_load_times_allow": [],
-            "page_load_times_block": [],
-        }
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from artifact_store import ArtifactStore
+from stats_store import StatsStore
 
 
-    def update_stat_single_set(self, stat_name, block, value):
-        self.stats[stat_name + '_' + allow_block(block)].add(value)
+class StatisticsCrawler:
+    # To keep track of the statistics for the analysis, one row per visited
+    # page in the stats store (see ../utils/stats_store.py)
 
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
 
-    def export_to_json(self):
-        def convert_to_serializable(obj):
-            if isinstance(obj, set):
-                return list(obj)
-            return obj
 
-        # timestamp = str(datetime.datetime.now())
-        with open(f"../analysis/stats.json", "w") as file:
-            json.dump(self.stats, file, indent=4, default=convert_to_serializable)
+    def update_visit(self, url, block, page_url=None, depth=0, **fields):
+        # fields: page_load_time, cache, consent_click_failure, page_load_timeout, error
+        site = get_fld(url, fail_silently=True) or url
+        self.store.record_visit(self.run_id, site, allow_block(block), url, page_url, depth, **fields)
 
 
 def parse_arguments():
@@ -47,13 +40,45 @@ def parse_arguments():
     parser.add_argument('-u', metavar='URL', help='Single URL to crawl')
     parser.add_argument('-l', metavar='FILE', help='File containing list of URLs to crawl')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--subpages', metavar='N', type=int, default=0, help='Also visit N same-site subpages per site')
+    parser.add_argument('--depth', metavar='D', type=int, default=1, help='Link depth to look for subpages')
+    parser.add_argument('--artifact-store', metavar='DIR', help='Store screenshots and videos by content hash in DIR')
+    parser.add_argument('--phash-threshold', metavar='BITS', type=int,
+                        help='Also deduplicate screenshots that differ in at most BITS bits of their perceptual hash')
+    parser.add_argument('--replay', metavar='DIR', help='Serve every site from its allow HAR file in DIR instead of the network')
+    parser.add_argument('--replay-unmatched', choices=['abort', 'fallback'], default='abort',
+                        help='What to do with requests that are not in the HAR file: abort them or go to the network')
+    parser.add_argument('--cache-dir', metavar='DIR', help='Share a persistent HTTP cache in DIR between the visits')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=512, help='Maximum size of the shared HTTP cache')
+    parser.add_argument('--stats-db', metavar='FILE', default='../analysis/stats.sqlite',
+                        help='SQLite database to add the statistics of this run to')
 
     args = parser.parse_args()
+    if args.subpages < 0:
+        parser.error('--subpages must be 0 or more')
+    if args.depth < 1:
+        parser.error('--depth must be 1 or more')
+
     block_trackers = args.block_trackers
     url = args.u
     file_path = args.l
     debug = args.debug
 
+    # Options of the crawl modes, passed on to the crawler
+    options = {
+        'subpages': args.subpages,
+        'depth': args.depth,
+        'artifact_store': None,
+        'replay': args.replay,
+        'replay_unmatched': args.replay_unmatched,
+        'cache_dir': os.path.abspath(args.cache_dir) if args.cache_dir else None,
+        'cache_size': args.cache_size,
+        'stats_db': args.stats_db,
+    }
+
+    if args.artifact_store is not None:
+        options['artifact_store'] = ArtifactStore(args.artifact_store, args.phash_threshold)
+
     urls = []
 
     # We will use the file path if it is provided
@@ -69,8 +94,9 @@ def parse_arguments():
 
     log.debug(f"Urls: {urls}")
     log.debug(f"Block trackers: {block_trackers}")
+    log.debug(f"Options: {options}")
 
-    return block_trackers, urls, file_path
+    return block_trackers, urls, file_path, options
 
 
 def read_lines_of_file(file_path):
@@ -85,16 +111,27 @@ def allow_block(block):
     return 'block' if block else 'allow'
 
 
-def accept_cookie(page, stats_crawler, url, block_trackers):
-    # To find the accept button on the page using a file, and attempt to click it
+def get_fld(url, **kwargs):
+    from tld import get_fld as tld_get_fld
 
+    return tld_get_fld(url, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def load_accept_words():
+    # Read once per process instead of for every visit
     accept_words = []
     with open("../utils/accept_words.txt", 'r', encoding="utf-8") as file:
         for line in file:
             accept_words.append(line.strip())
+    return tuple(accept_words)
+
+
+def accept_cookie(page, stats_crawler, url, block_trackers):
+    # To find the accept button on the page using a file, and attempt to click it
 
     found_accept_button_or_link = False
-    for word in accept_words:
+    for word in load_accept_words():
         # Check for button with text containing the accept word
         accept_button = page.query_selector(f'button:has-text("{word}")')
         if accept_button:
@@ -116,8 +153,7 @@ def accept_cookie(page, stats_crawler, url, block_trackers):
 
     if not found_accept_button_or_link:
         log.debug("Failed to find accept button or link")
-        domain_of_url = get_fld(url)
-        stats_crawler.update_stat_single_set("consent_click_failure", block_trackers, domain_of_url)
+        stats_crawler.update_visit(url, block_trackers, consent_click_failure=True)
 
     return page
 
@@ -143,10 +179,13 @@ def block_tracker_requests(route, request, block_list):
     if domain_of_request_url in block_list:
         log.debug(f"Blocking request to {domain_of_request_url}")
         return route.abort()
-    return route.continue_()
+    # Hand the request on to the replay routes of the context, if any, or else the network
+    return route.fallback()
 
 
+@functools.lru_cache(maxsize=None)
 def load_block_list():
+    # Loaded once per process, and a frozenset so every request is a quick lookup
     with open("../utils/services.json", "r", encoding="utf-8") as f:
         blocklist_data = json.load(f)
 
@@ -159,115 +198,333 @@ def load_block_list():
                     if isinstance(block_domains, list):
                         block_list.extend(block_domains)
 
-    return list(set(block_list))
+    return frozenset(block_list)
+
+
+def get_same_site_links(page, url_domain):
+    # Links to other pages of the same site, from all frames of the page
+    links = []
+    for frame in page.frames:
+        try:
+            links.extend(frame.evaluate("Array.from(document.links, a => a.href)"))
+        except Exception:
+            continue  # frame was detached in the meantime
+
+    same_site_links = []
+    for link in links:
+        link = link.split('#', 1)[0]
+        if link.startswith('http') and get_fld(link, fail_silently=True) == url_domain:
+            same_site_links.append(link)
+
+    return list(dict.fromkeys(same_site_links))
+
+
+def visit_subpages(context, url, landing_url, links, url_domain, block_trackers, block_list, stats_crawler, options):
+    # Visit a sample of the same-site links of the (closed) landing page in
+    # the same context, so the consent cookies and the HTTP cache of the
+    # landing page are reused. Every subpage is a new page, which gives its
+    # requests their own pageref in the HAR.
+    rng = random.Random(url_domain)
+    visited = {url.split('#', 1)[0], landing_url.split('#', 1)[0]}
+    queue = [(link, 1) for link in links]
+    rng.shuffle(queue)
+
+    num_visited = 0
+    while queue and num_visited < options['subpages']:
+        subpage_url, depth = queue.pop(0)
+        if subpage_url in visited:
+            continue
+        visited.add(subpage_url)
+        num_visited += 1
+
+        log.debug(f"Visiting subpage {num_visited} at depth {depth}: {subpage_url}")
+        subpage = context.new_page()
+        if block_trackers:
+            subpage.route("**/*", lambda route, request: block_tracker_requests(route, request, block_list))
+
+        try:
+            start_time = time.time()
+            subpage.goto(subpage_url)
+            subpage.wait_for_load_state('load')
+            stats_crawler.update_visit(url, block_trackers, subpage_url, depth, page_load_time=time.time() - start_time)
+
+            subpage.wait_for_timeout(3000)
+            scroll_to_bottom_in_multiple_steps(subpage)
+
+            if depth < options['depth']:
+                links = get_same_site_links(subpage, url_domain)
+                rng.shuffle(links)
+                queue.extend((link, depth + 1) for link in links)
+        except Exception as e:
+            log.debug(f"Failed to visit subpage {subpage_url}: {e}")
+            stats_crawler.update_visit(url, block_trackers, subpage_url, depth, error=str(e))
+        finally:
+            subpage.close()
+            # Only the landing page is recorded on video
+            if subpage.video:
+                subpage.video.delete()
+
+
+def split_har_by_page(har_file_path, subpage_dir, unattributed_dir):
+    # The context records a single HAR for the landing page and its subpages.
+    # Keep only the landing page in the original file and write every
+    # subpage to {subpage_dir}/{name}_{i}.har. Entries without a known
+    # pageref (worker and service worker requests of any of the pages) go to
+    # {unattributed_dir}/{name}.har, so they do not count for the landing page.
+    with open(har_file_path, 'r', encoding='utf-8') as file:
+        har = json.load(file)
+
+    pages = har['log'].get('pages', [])
+    if len(pages) <= 1:
+        return
+
+    entries_per_page = {page['id']: [] for page in pages}
+    unattributed = []
+    for entry in har['log']['entries']:
+        entries_per_page.get(entry.get('pageref'), unattributed).append(entry)
+
+    os.makedirs(subpage_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(har_file_path))[0]
+    for i, page in enumerate(pages):
+        page_har = dict(har, log=dict(har['log'], pages=[page], entries=entries_per_page[page['id']]))
+        page_har_path = har_file_path if i == 0 else os.path.join(subpage_dir, f"{name}_{i}.har")
+        with open(page_har_path, 'w', encoding='utf-8') as file:
+            json.dump(page_har, file)
+
+    if unattributed:
+        os.makedirs(unattributed_dir, exist_ok=True)
+        unattributed_har = dict(har, log=dict(har['log'], pages=[], entries=unattributed))
+        with open(os.path.join(unattributed_dir, f"{name}.har"), 'w', encoding='utf-8') as file:
+            json.dump(unattributed_har, file)
+
+
+def route_from_recorded_har(context, url_domain, options):
+    # Serve the requests of the context from the HAR files of an earlier allow
+    # crawl. The routes registered last are tried first, so the subpage HAR
+    # files fall back to the landing page HAR file, which decides what happens
+    # with requests that were not recorded.
+    har_name = f"{url_domain}_allow"
+    har_path = os.path.join(options['replay'], har_name + ".har")
+    if not os.path.exists(har_path):
+        raise FileNotFoundError(f"No recorded HAR file to replay: {har_path}")
+
+    context.route_from_har(har_path, not_found=options['replay_unmatched'])
+    subpage_har_paths = glob.glob(os.path.join(options['replay'], "subpages", har_name + "_[0-9]*.har"))
+    for subpage_har_path in sorted(subpage_har_paths):
+        context.route_from_har(subpage_har_path, not_found='fallback')
+
+
+def cache_state(cache_dir):
+    # The visit starts warm when an earlier visit already filled the shared cache
+    if cache_dir is not None and os.path.isdir(cache_dir) and os.listdir(cache_dir):
+        return 'warm'
+    return 'cold'
+
+
+def launch_context(playwright, options, **context_options):
+    # Returns (browser, context, profile_dir). Normally every visit gets a new
+    # incognito context. In cache mode every visit gets a new, temporary
+    # profile instead (a persistent context, which opens with a blank page),
+    # so cookies and storage stay isolated, while the HTTP cache lives in the
+    # shared cache directory. Visits run one after the
+    # other, so the cache is never opened by two browsers at the same time.
+    if options['cache_dir'] is None:
+        browser = playwright.chromium.launch(headless=True, slow_mo=50)
+        try:
+            return browser, browser.new_context(**context_options), None
+        except Exception:
+            browser.close()
+            raise
+
+    profile_dir = tempfile.mkdtemp(dir=options['profile_root'])
+    context = playwright.chromium.launch_persistent_context(
+        profile_dir,
+        headless=True,
+        slow_mo=50,
+        args=[
+            f"--disk-cache-dir={options['cache_dir']}",
+            f"--disk-cache-size={options['cache_size'] * 2 ** 20}",
+        ],
+        **context_options
+    )
+    return None, context, profile_dir
+
 
+def save_screenshot(page, path, store, artifacts, role):
+    # Into the artifact store if there is one, otherwise next to the HAR file
+    if store is None:
+        page.screenshot(path=path)
+    else:
+        artifacts[role] = store.put_screenshot(page.screenshot())
 
-def crawler(playwright, url, block_trackers, stats_crawler, url_index):
-    browser = playwright.chromium.launch(headless=True, slow_mo=50)
-    context = browser.new_context()
+
+def crawler(playwright, url, block_trackers, stats_crawler, url_index, options):
     url_domain = get_fld(url)
 
+    # Replayed crawls are written next to the live ones, never over the HAR files they replay
     variant = allow_block(block_trackers)
-    record_video_dir = f"../crawl_data_{variant}/"
-    har_file_path = f"../crawl_data_{variant}/{url_domain}_{variant}.har"
-
-    context = browser.new_context(
+    crawl_dir = f"../crawl_data_replay_{variant}/" if options['replay'] else f"../crawl_data_{variant}/"
+    os.makedirs(crawl_dir, exist_ok=True)
+    record_video_dir = crawl_dir
+    har_file_path = f"{crawl_dir}{url_domain}_{variant}.har"
+
+    # Playwright turns off the HTTP cache of a page with request routing,
+    # so only the allow variant of a live crawl can start warm
+    if block_trackers or options['replay']:
+        cache = 'cold'
+    else:
+        cache = cache_state(options['cache_dir'])
+
+    browser, context, profile_dir = launch_context(
+        playwright,
+        options,
         record_video_dir=record_video_dir,
         record_video_size={"width": 640, "height": 480},
         record_har_path=har_file_path
     )
-    page = context.new_page()
-
-    # If block_trackers is True, then we block the tracker requests here
-    block_list = load_block_list()
-    if block_trackers:
-        page.route("**/*", lambda route, request: block_tracker_requests(route, request, block_list))
-
-    # Start tracking time so we can use it for load times
-    log.debug('Loading the page')
-    start_time = time.time()
-    page.goto(url)
-
-    page.wait_for_load_state('load')
-    end_time = time.time()
-    page_load_time = end_time - start_time
-
-    stats_crawler.stats['page_load_times_' + allow_block(block_trackers)].append({
-        'url': url, 'page_load_time': page_load_time})
-
-    # Wait 10s
-    page.wait_for_timeout(10000) # Change to 10s later
-
-    # Screenshot of the page before accepting cookies
-    page.screenshot(path=f"../crawl_data_{variant}/{url_domain}_{variant}_pre_consent.png")
-
-    # Accept all cookies
-    log.debug('Trying to accept cookies')
+    # Everything after the launch is in a try, so a failed visit (a page.goto
+    # timeout, say) still closes the browser and releases the shared cache
+    # before the next visit launches one
     try:
-        page = accept_cookie(page, stats_crawler, url, block_trackers)
-    except:
-        stats_crawler.update_stat_single_set("page_load_timeout", block_trackers, url_domain)
-
-    # We need the cookies one day probably
-    cookies = context.cookies()
-
-    # Screenshot of the page after accepting cookies
-    page.screenshot(path=f"../crawl_data_{variant}/{url_domain}_{variant}_post_consent.png")
-
-    # wait 3s
-    page.wait_for_timeout(3000)
-
-    # Scroll all the way down, in multiple steps
-    log.debug('Scrolling down the page')
-    page = scroll_to_bottom_in_multiple_steps(page)
-
-    # wait 3s
-    page.wait_for_timeout(3000)
-
-    # Saving the video
-    video_path = page.video.path()
-
-    context.close()
-    browser.close()
-
-    new_video_path = os.path.dirname(video_path) + f"/{url_domain}_{variant}.webm"
-    os.replace(video_path, new_video_path)
-
-
-def run_crawler(playwright, url, block_trackers, stats_crawler, url_index, num_urls):
+        if options['replay']:
+            route_from_recorded_har(context, url_domain, options)
+        # A persistent context (cache mode) already has a blank page, which is
+        # recorded too. Use it, so it does not leave a stray video behind.
+        if context.pages:
+            page = context.pages[0]
+        else:
+            page = context.new_page()
+
+        # If block_trackers is True, then we block the tracker requests here
+        block_list = load_block_list() if block_trackers else None
+        if block_trackers:
+            page.route("**/*", lambda route, request: block_tracker_requests(route, request, block_list))
+
+        # Start tracking time so we can use it for load times
+        log.debug('Loading the page')
+        start_time = time.time()
+        page.goto(url)
+
+        page.wait_for_load_state('load')
+        end_time = time.time()
+        page_load_time = end_time - start_time
+
+        stats_crawler.update_visit(url, block_trackers, page_load_time=page_load_time, cache=cache)
+
+        # Wait 10s
+        page.wait_for_timeout(10000) # Change to 10s later
+
+        # Screenshot of the page before accepting cookies
+        store = options['artifact_store']
+        artifacts = {}
+        save_screenshot(page, f"{crawl_dir}{url_domain}_{variant}_pre_consent.png", store, artifacts, 'pre_consent')
+
+        # Accept all cookies
+        log.debug('Trying to accept cookies')
+        try:
+            page = accept_cookie(page, stats_crawler, url, block_trackers)
+        except:
+            stats_crawler.update_visit(url, block_trackers, page_load_timeout=True)
+
+        # We need the cookies one day probably
+        cookies = context.cookies()
+
+        # Screenshot of the page after accepting cookies
+        save_screenshot(page, f"{crawl_dir}{url_domain}_{variant}_post_consent.png", store, artifacts, 'post_consent')
+
+        # wait 3s
+        page.wait_for_timeout(3000)
+
+        # Scroll all the way down, in multiple steps
+        log.debug('Scrolling down the page')
+        page = scroll_to_bottom_in_multiple_steps(page)
+
+        # wait 3s
+        page.wait_for_timeout(3000)
+
+        # Saving the video
+        video_path = page.video.path()
+
+        # Visit subpages with the consent cookies and warm cache of this context.
+        # The landing page is closed first, so its later requests (ad refreshes,
+        # beacons) do not end up in its pageref and its video ends here.
+        if options['subpages'] > 0:
+            landing_url = page.url
+            links = get_same_site_links(page, url_domain)
+            page.close()
+            log.debug('Visiting subpages')
+            visit_subpages(context, url, landing_url, links, url_domain, block_trackers, block_list, stats_crawler, options)
+    finally:
+        try:
+            context.close()
+        finally:
+            if browser is not None:
+                browser.close()
+            if profile_dir is not None:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+
+    if options['subpages'] > 0:
+        split_har_by_page(har_file_path, f"{crawl_dir}subpages/", f"{crawl_dir}unattributed/")
+
+    if store is None:
+        new_video_path = os.path.dirname(video_path) + f"/{url_domain}_{variant}.webm"
+        os.replace(video_path, new_video_path)
+    else:
+        artifacts['video'] = store.put_file(video_path, '.webm')
+        timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        store.write_manifest(f"{url_domain}_{variant}_{timestamp}", artifacts,
+                             url=url, variant=variant, har=har_file_path)
+
+
+def run_crawler(playwright, url, block_trackers, stats_crawler, url_index, num_urls, options):
     log.debug(f'{url_index + 1}/{num_urls} Running crawler on {url} with {allow_block(block_trackers)}')
     try:
-        crawler(playwright, url, block_trackers, stats_crawler, url_index)
+        crawler(playwright, url, block_trackers, stats_crawler, url_index, options)
     except Exception as e:
         print("Failed to crawl page:", url)
         print("Error:", e)
+        stats_crawler.update_visit(url, block_trackers, error=str(e))
 
 
 def main():
     # python crawl.py -u "https://business.gov.nl/" --debug --block-trackers
     # python crawl.py -l "../utils/nl-gov-sites.txt" --debug --block-trackers
+    # python crawl.py -l "../utils/nl-gov-sites.txt" --block-trackers --subpages 5 --depth 2
+    # python crawl.py -l "../utils/nl-gov-sites.txt" --block-trackers --replay ../crawl_data_allow/
+    # python crawl.py -l "../utils/nl-gov-sites.txt" --cache-dir ../browser_cache --cache-size 256
 
     # Gather arguments in variables
-    block_trackers, urls, file_path = parse_arguments()
+    block_trackers, urls, file_path, options = parse_arguments()
+
+    from playwright.sync_api import sync_playwright
+    import tqdm, tqdm.contrib.logging
+
+    # Create a statistics crawler, which adds this run to the stats store
+    store = StatsStore(options['stats_db'])
+    run_id = store.start_run(' '.join(sys.argv))
+    log.info(f"Run {run_id}, statistics in {options['stats_db']}")
+    stats_crawler = StatisticsCrawler(store, run_id)
 
-    # Create a statistics crawler
-    stats_crawler = StatisticsCrawler()
+    # The temporary profiles of the cache mode, removed even when a visit fails
+    with tempfile.TemporaryDirectory(prefix='crawl_profiles_') as profile_root:
+        options['profile_root'] = profile_root
 
-    with sync_playwright() as playwright:
-        with tqdm.contrib.logging.logging_redirect_tqdm():
-            # Two crawlers for every url, one with blocking trackers and one without
-            for url_index, url in tqdm.tqdm(enumerate(urls), total=len(urls)):
-            # for url_index, url in enumerate(urls):
+        with sync_playwright() as playwright:
+            with tqdm.contrib.logging.logging_redirect_tqdm():
+                # Two crawlers for every url, one with blocking trackers and one without
+                for url_index, url in tqdm.tqdm(enumerate(urls), total=len(urls)):
+                # for url_index, url in enumerate(urls):
 
-                # Once for allowing trackers
-                run_crawler(playwright, url, False, stats_crawler, url_index, len(urls))
+                    # Once for allowing trackers
+                    run_crawler(playwright, url, False, stats_crawler, url_index, len(urls), options)
 
-                # Once for blocking trackers
-                if block_trackers:
-                    run_crawler(playwright, url, True, stats_crawler, url_index, len(urls))
+                    # Once for blocking trackers
+                    if block_trackers:
+                        run_crawler(playwright, url, True, stats_crawler, url_index, len(urls), options)
 
-    # Getting some statistics that cannot be retrieved from the har files
-    stats_crawler.export_to_json()
+    # The statistics that cannot be retrieved from the har files are already in the store
+    store.finish_run(run_id)
+    store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+# Content-addressed store for the screenshots and videos of a crawl.
+#
+# Files are stored once under their SHA-256 in a sharded layout,
+# objects/ab/cd/abcd....png, so repeated crawls and identical pages (error
+# pages, parked domains, shared templates) do not store the same bytes
+# again and no directory grows with the number of visits. Every visit gets
+# a small JSON manifest that points to its artifacts.
+#
+# Screenshots can also be deduplicated by perceptual hash (needs Pillow,
+# which is only imported when that is enabled), so pages that only differ in
+# a few pixels share one image.
+
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1 << 20
+
+
+def dhash(image_path_or_file, size=8):
+    # 64-bit difference hash: compares neighbouring pixels of a small grey image
+    from PIL import Image
+
+    with Image.open(image_path_or_file) as image:
+        pixels = list(image.convert('L').resize((size + 1, size)).getdata())
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class ArtifactStore:
+
+    def __init__(self, root, phash_threshold=None):
+        # phash_threshold: maximum number of differing bits (at most 7) for
+        # two screenshots to count as the same, None disables it
+        if phash_threshold is not None:
+            if importlib.util.find_spec('PIL') is None:
+                raise ImportError("Perceptual hash deduplication requires Pillow")
+            if not 0 <= phash_threshold <= 7:
+                raise ValueError("phash_threshold must be between 0 and 7")
+
+        self.root = root
+        self.phash_threshold = phash_threshold
+        # Mode of a newly created file, which the temporary files of put_bytes do not get
+        umask = os.umask(0)
+        os.umask(umask)
+        self.file_mode = 0o666 & ~umask
+        self.phash_index_path = os.path.join(root, 'phash_index.jsonl')
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'manifests'), exist_ok=True)
+
+        # With at most 7 differing bits, one of the 8 bytes of a near duplicate
+        # is equal, so only hashes that share a byte have to be compared
+        self.phash_bands = [{} for _ in range(8)]
+        if phash_threshold is not None and os.path.exists(self.phash_index_path):
+            with open(self.phash_index_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    record = json.loads(line)
+                    self._index_phash(record['phash'], record['object'])
+
+
+    def object_path(self, digest, ext):
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4], digest + ext)
+
+
+    def _store(self, write, digest, ext, size):
+        # write(path) puts the content in place, unless the object already exists
+        path = self.object_path(digest, ext)
+        duplicate = os.path.exists(path)
+        if not duplicate:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write(path)
+        return {'object': os.path.relpath(path, self.root), 'sha256': digest, 'size': size, 'duplicate': duplicate}
+
+
+    def put_bytes(self, data, ext):
+        digest = hashlib.sha256(data).hexdigest()
+
+        def write(path):
+            # Write next to the target and rename, so a partial file is never visible
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.chmod(tmp_path, self.file_mode)
+            os.replace(tmp_path, path)
+
+        return self._store(write, digest, ext, len(data))
+
+
+    def put_file(self, source_path, ext=None, move=True):
+        if ext is None:
+            ext = os.path.splitext(source_path)[1]
+
+        sha256 = hashlib.sha256()
+        with open(source_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+
+        def write(path):
+            if move:
+                shutil.move(source_path, path)
+            else:
+                shutil.copyfile(source_path, path)
+
+        record = self._store(write, sha256.hexdigest(), ext, os.path.getsize(source_path))
+        if move and record['duplicate']:
+            os.remove(source_path)
+        return record
+
+
+    def _index_phash(self, phash, object_path):
+        for band in range(8):
+            key = (phash >> (8 * band)) & 0xff
+            self.phash_bands[band].setdefault(key, []).append((phash, object_path))
+
+
+    def _find_near_duplicate(self, phash):
+        for band in range(8):
+            key = (phash >> (8 * band)) & 0xff
+            for other, object_path in self.phash_bands[band].get(key, ()):
+                if bin(phash ^ other).count('1') <= self.phash_threshold:
+                    return object_path
+        return None
+
+
+    def put_screenshot(self, data, ext='.png'):
+        if self.phash_threshold is None:
+            return self.put_bytes(data, ext)
+
+        phash = dhash(io.BytesIO(data))
+        near_duplicate = self._find_near_duplicate(phash)
+        if near_duplicate is not None:
+            # Describe the stored image, the screenshot itself is not kept
+            return {
+                'object': near_duplicate,
+                'sha256': os.path.splitext(os.path.basename(near_duplicate))[0],
+                'size': os.path.getsize(os.path.join(self.root, near_duplicate)),
+                'duplicate': True,
+                'phash': phash,
+                'original_sha256': hashlib.sha256(data).hexdigest(),
+                'original_size': len(data),
+            }
+
+        record = self.put_bytes(data, ext)
+        record['phash'] = phash
+        if not record['duplicate']:
+            self._index_phash(phash, record['object'])
+            with open(self.phash_index_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({'phash': phash, 'object': record['object']}) + '\n')
+        return record
+
+
+    def manifest_path(self, visit_id):
+        shard = hashlib.sha256(visit_id.encode('utf-8')).hexdigest()[:2]
+        return os.path.join(self.root, 'manifests', shard, visit_id + '.json')
+
+
+    def write_manifest(self, visit_id, artifacts, **metadata):
+        # artifacts: {role: record returned by one of the put methods}
+        path = self.manifest_path(visit_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(dict(metadata, visit_id=visit_id, artifacts=artifacts), file, indent=4)
+        return path
+
+
+    def read_manifest(self, visit_id):
+        with open(self.manifest_path(visit_id), 'r', encoding='utf-8') as file:
+            return json.load(file)
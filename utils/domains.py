@@ -0,0 +1,31 @@
+# Cached eTLD+1 helpers shared by the analysis scripts.
+#
+# A crawl contains the same few hundred hosts over and over, so the public
+# suffix lookup is memoised on the host name instead of being redone for
+# every request url. tldextract is imported on the first lookup, it is slow
+# to import and not every user of this module needs it.
+
+import functools
+from urllib.parse import urlsplit
+
+
+def hostname(url):
+    # Accept both full urls and bare host names
+    if '//' not in url:
+        url = '//' + url
+    try:
+        return urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def registered_domain_of_host(host):
+    import tldextract
+
+    return tldextract.extract(host).registered_domain
+
+
+def registered_domain(url):
+    # eTLD+1 of the url, or '' if it has none (ip addresses, data: urls, ...)
+    return registered_domain_of_host(hostname(url))
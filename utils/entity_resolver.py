@@ -0,0 +1,114 @@
+# Resolve domains to the entity (company) that owns them using domain_map.json.
+#
+# The domain map is parsed once per process, or read from a compact index
+# that is written next to it, and every lookup is memoised. Subdomains that
+# are not in the map are attributed to their nearest known ancestor, so
+# 'stats.g.doubleclick.net' resolves through 'doubleclick.net'.
+
+import functools
+import json
+import os
+
+
+class EntityResolver:
+
+    def __init__(self, entities):
+        # entities: {domain: entity name}
+        self.entities = entities
+        self._cache = {}
+
+
+    @classmethod
+    def from_domain_map(cls, domain_map):
+        return cls({
+            domain: entry['entityName'].replace('\\"', '"')
+            for domain, entry in domain_map.items()
+            if 'entityName' in entry
+        })
+
+
+    def entity_of(self, domain, default=None):
+        # Walk up the labels of the domain until a known ancestor is found
+        try:
+            entity = self._cache[domain]
+        except KeyError:
+            entity = None
+            labels = domain.lower().rstrip('.').split('.')
+            for i in range(len(labels) - 1):
+                entity = self.entities.get('.'.join(labels[i:]))
+                if entity is not None:
+                    break
+            self._cache[domain] = entity
+
+        return default if entity is None else entity
+
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+    def resolve(self, domains, default=None):
+        # Batch variant of entity_of, every distinct domain is looked up once
+        domains = list(domains)
+        resolved = {domain: self.entity_of(domain, default) for domain in set(domains)}
+        return [resolved[domain] for domain in domains]
+
+
+    def save_index(self, index_path, source_mtime=None):
+        # Store only the domain -> entity pairs, with the entity names interned
+        names = sorted(set(self.entities.values()))
+        name_ids = {name: i for i, name in enumerate(names)}
+        index = {
+            'source_mtime': source_mtime,
+            'entities': names,
+            'domains': {domain: name_ids[name] for domain, name in self.entities.items()},
+        }
+        with open(index_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file, separators=(',', ':'))
+
+
+    @classmethod
+    def load_index(cls, index_path, source_mtime=None):
+        # Returns None if the index is missing or older than the domain map
+        try:
+            with open(index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if source_mtime is not None and index.get('source_mtime') != source_mtime:
+            return None
+
+        names = index['entities']
+        return cls({domain: names[i] for domain, i in index['domains'].items()})
+
+
+def index_path_for(domain_map_path):
+    return os.path.splitext(domain_map_path)[0] + '.index.json'
+
+
+@functools.lru_cache(maxsize=None)
+def _load_entity_resolver(domain_map_path, use_index):
+    source_mtime = os.path.getmtime(domain_map_path)
+    index_path = index_path_for(domain_map_path)
+
+    if use_index:
+        resolver = EntityResolver.load_index(index_path, source_mtime)
+        if resolver is not None:
+            return resolver
+
+    with open(domain_map_path, 'r', encoding='utf-8') as file:
+        resolver = EntityResolver.from_domain_map(json.load(file))
+
+    if use_index:
+        try:
+            resolver.save_index(index_path, source_mtime)
+        except OSError:
+            pass  # read-only location, just keep the in-memory resolver
+
+    return resolver
+
+
+def load_entity_resolver(domain_map_path='domain_map.json', use_index=True):
+    # Shared per process, so calling this in a loop is free
+    return _load_entity_resolver(os.path.abspath(domain_map_path), use_index)
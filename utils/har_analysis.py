@@ -0,0 +1,370 @@
+# The analysis functions of analysis/analysis.ipynb, as a module so they can
+# also be used by scripts and the benchmarks. The notebook imports them from
+# here.
+#
+# The counting functions have an approximate mode for very large crawls. It
+# uses the fixed-memory sketches of sketches.py (see there for the error
+# bounds) instead of exact sets and dictionaries.
+
+import functools
+import json
+import os
+
+from domains import registered_domain
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+
+SERVICES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services.json')
+
+# HyperLogLog precision for the distinct domains of a single site (1 KB, ~3.3% error)
+SITE_PRECISION = 10
+
+
+def load_file(path):
+    # Loads the har files obtained from the website
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def extract_domain_info(url):
+    # Obtains the domains of the urls
+    return registered_domain(url)
+
+
+def extract_entity_name(domain, resolver):
+    # Obtains the entity_name of the organization that owns the domain names of the request urls
+    return resolver.entity_of(registered_domain(domain), "Unknown")
+
+
+def load_har_files(directory):
+    # Load in all the har files
+    hars_data = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.har'):
+            file_path = os.path.join(directory, filename)
+            file_path = file_path.replace("\\", "/")
+
+            har_data = load_file(file_path)
+            hars_data.append(har_data)
+
+    return hars_data
+
+
+@functools.lru_cache(maxsize=None)
+def load_block_list(path=SERVICES_PATH):
+    # Load disconnect's block list domains, once per process. A frozenset, so
+    # the cached list cannot be changed by a caller and lookups are fast.
+    with open(path, "r", encoding="utf-8") as f:
+        blocklist_data = json.load(f)
+
+    block_list = []
+
+    for category_name, category_data in blocklist_data['categories'].items():
+        for entry in category_data:
+            for _company_name, domains in entry.items():
+                for _domain, block_domains in domains.items():
+                    if isinstance(block_domains, list):
+                        block_list.extend(block_domains)
+
+    return frozenset(block_list)
+
+
+def count_requests(hars):
+    return [len(har['log']['entries']) for har in hars]
+
+
+def count_third_party(hars, approximate=False):
+    third_party_counts = []
+
+    for har in hars:
+        main_url = har['log']['entries'][0]['request']['url']
+        main_domain = extract_domain_info(main_url)
+
+        third_party_domains = HyperLogLog(SITE_PRECISION) if approximate else set()
+
+        for entry in har['log']['entries'][1:]:
+            url = entry['request']['url']
+            domain = extract_domain_info(url)
+
+            # blocked by block list
+            if entry['response']['status'] == -1:
+                continue
+
+            if domain and domain != main_domain:
+                third_party_domains.add(domain)
+
+        third_party_counts.append(len(third_party_domains))
+
+    return third_party_counts
+
+
+def count_tracker_domains(hars, disconnect_domains=None, approximate=False):
+    if disconnect_domains is None:
+        disconnect_domains = load_block_list()
+
+    tracker_counts = []
+
+    for har in hars:
+        main_url = har['log']['entries'][0]['request']['url']
+        main_domain = extract_domain_info(main_url)
+
+        tracker_domains = HyperLogLog(SITE_PRECISION) if approximate else set()
+
+        for entry in har['log']['entries'][1:]:
+            url = entry['request']['url']
+            domain = extract_domain_info(url)
+
+            # blocked by block list
+            if entry['response']['status'] == -1:
+                continue
+
+            if domain and domain != main_domain and domain in disconnect_domains:
+                tracker_domains.add(domain)
+
+        tracker_counts.append(len(tracker_domains))
+
+    return tracker_counts
+
+
+def count_same_site(hars):
+    third_party_counts = []
+
+    for har in hars:
+        main_url = har['log']['entries'][0]['request']['url']
+        main_domain = extract_domain_info(main_url)
+
+        third_party_domains = set()
+
+        for entry in har['log']['entries'][1:]:
+            url = entry['request']['url']
+            domain = extract_domain_info(url)
+
+            # blocked by block list
+            if entry['response']['status'] == -1:
+                continue
+
+            if domain and domain != main_domain:
+                cookie_response = entry['response'].get('cookies', [])
+                for cookie in cookie_response:
+                    if not cookie.get('Partitioned') and cookie.get('sameSite') == 'None':
+                        third_party_domains.add(domain)
+
+        third_party_counts.append(len(third_party_domains))
+
+    return third_party_counts
+
+
+def prevalent_third_party(hars, disconnect_domains=None, approximate=False, capacity=100):
+    # The approximate mode only keeps the `capacity` most prevalent domains
+    if disconnect_domains is None:
+        disconnect_domains = load_block_list()
+
+    if approximate:
+        sketch = ThirdPartySketch(capacity)
+        for har in hars:
+            sketch.add_har(har)
+        return sketch.prevalence(disconnect_domains)
+
+    websites_tracker_info = {}
+
+    for har in hars:
+            main_url = har['log']['entries'][0]['request']['url']
+            main_domain = extract_domain_info(main_url)
+
+            for entry in har['log']['entries']:
+                url = entry['request']['url']
+                domain = extract_domain_info(url)
+
+                if domain and domain != main_domain:
+                    if domain not in websites_tracker_info:
+                        websites_tracker_info[domain] = [1, 'Yes' if domain in disconnect_domains else 'No']
+                    else:
+                        websites_tracker_info[domain][0] += 1
+
+    return websites_tracker_info
+
+
+def count_distinct_third_party(hars, approximate=False, precision=14):
+    # Number of distinct third-party domains over all the websites
+    if approximate:
+        # Only the memory across websites is fixed, the domains of one
+        # website are deduplicated first so each is hashed once per website
+        distinct = HyperLogLog(precision)
+        for har in hars:
+            main_domain = extract_domain_info(har['log']['entries'][0]['request']['url'])
+            site_domains = set()
+            for entry in har['log']['entries']:
+                site_domains.add(extract_domain_info(entry['request']['url']))
+            site_domains.discard('')
+            site_domains.discard(main_domain)
+            distinct.update(site_domains)
+        return distinct.count()
+
+    third_party_domains = set()
+    for har in hars:
+        main_domain = extract_domain_info(har['log']['entries'][0]['request']['url'])
+        for entry in har['log']['entries']:
+            domain = extract_domain_info(entry['request']['url'])
+            if domain and domain != main_domain:
+                third_party_domains.add(domain)
+
+    return len(third_party_domains)
+
+
+class ThirdPartySketch:
+    # Third-party prevalence of many websites in fixed memory. Sketches of
+    # different workers can be merged, so a crawl can be split over processes.
+
+    def __init__(self, capacity=100, precision=14, width=2048, depth=4):
+        self.distinct = HyperLogLog(precision)
+        self.top = SpaceSaving(capacity)
+        self.counts = CountMinSketch(width, depth)
+
+
+    def add_har(self, har):
+        # Counts every request to a third party, like prevalent_third_party
+        main_url = har['log']['entries'][0]['request']['url']
+        main_domain = extract_domain_info(main_url)
+
+        for entry in har['log']['entries']:
+            domain = extract_domain_info(entry['request']['url'])
+            if domain and domain != main_domain:
+                self.distinct.add(domain)
+                self.top.add(domain)
+                self.counts.add(domain)
+
+
+    def merge(self, other):
+        self.distinct.merge(other.distinct)
+        self.top.merge(other.top)
+        self.counts.merge(other.counts)
+        return self
+
+
+    def prevalence(self, disconnect_domains):
+        # Same format as prevalent_third_party, both sketches overestimate so the smallest count is the best one
+        return {
+            domain: [min(count, self.counts.count(domain)), 'Yes' if domain in disconnect_domains else 'No']
+            for domain, count, _error in self.top.top()
+        }
+
+
+def frequency_methods(hars):
+    frequency_methods = {}
+
+    for har in hars:
+        for entry in har['log']['entries']:
+            headers_request = entry['request']
+            method = headers_request.get("method")
+
+            if method not in frequency_methods:
+                frequency_methods[method] = 1
+            else:
+                frequency_methods[method] += 1
+
+    return frequency_methods
+
+
+def analyze_permissions(hars):
+    permissions_lists = {
+        "geolocation": set(),
+        "camera": set(),
+        "microphone": set(),
+    }
+
+    for har in hars:
+        for entry in har['log']['entries']:
+            response_headers = entry['response']['headers']
+
+            permissions_policy = None
+            for header in response_headers:
+                if header['name'] == 'Permissions-Policy':
+                    permissions_policy = header['value']
+                    break
+
+            if permissions_policy:
+                url = entry['request']['url']
+                domain = extract_domain_info(url)
+
+                if "geolocation=()" in permissions_policy:
+                    permissions_lists["geolocation"].add(domain)
+
+                if "camera=()" in permissions_policy:
+                    permissions_lists["camera"].add(domain)
+
+                if "microphone=()" in permissions_policy:
+                    permissions_lists["microphone"].add(domain)
+
+    return permissions_lists
+
+
+def analyze_referrer_policy(hars):
+    no_referrer_sites = set()
+    unsafe_url_sites = set()
+
+    for har in hars:
+        for entry in har['log']['entries']:
+            response_headers = entry['response']['headers']
+            url = entry['request']['url']
+
+            # Extract Referrer-Policy headers
+            for header in response_headers:
+                if header['name'].lower() == 'referrer-policy':
+                    policy_value = header['value'].strip().lower()
+
+                    # Check for no-referrer and unsafe-url values
+                    domain = extract_domain_info(har['log']['entries'][0]['request']['url'])
+                    if policy_value == 'no-referrer':
+                        no_referrer_sites.add(domain)
+                    elif policy_value == 'unsafe-url':
+                        unsafe_url_sites.add(domain)
+
+    return no_referrer_sites, unsafe_url_sites
+
+
+def analyze_client_hints(hars):
+    client_hint_counts = {}
+
+    for har in hars:
+        for entry in har['log']['entries']:
+            url = entry['request']['url']
+            domain = extract_domain_info(url)
+
+            headers = entry['request']['headers'] + entry['response']['headers']
+
+            for header in headers:
+                if header['name'].lower() == 'accept-ch':
+                    client_hints = header['value'].strip().split(',')
+
+                    for client_hint in client_hints:
+                        if client_hint in client_hint_counts:
+                            client_hint_counts[client_hint].add(domain)
+                            break
+                        else:
+                            client_hint_counts[client_hint] = set([domain])
+
+    return client_hint_counts
+
+
+def analyze_redirections(hars):
+    redirections = {}
+
+    for har in hars:
+        main_url = har['log']['entries'][0]['request']['url']
+        main_domain = extract_domain_info(main_url)
+
+        for entry in har['log']['entries']:
+            target_url = entry['response']['redirectURL']
+            if target_url != "":
+                source_url = entry['request']['url']
+                source_domain = extract_domain_info(source_url)
+                target_domain = extract_domain_info(target_url)
+
+                if source_domain != target_domain:
+                    if not source_domain in redirections:
+                        redirections[source_domain] = {}
+                    if not target_domain in redirections[source_domain]:
+                        redirections[source_domain][target_domain] = set()
+
+                    redirections[source_domain][target_domain].add(main_domain)
+
+    return redirections
@@ -0,0 +1,176 @@
+# Per-site differences between the allow and block crawls.
+#
+# The HAR files of both crawls are joined on their site key (the {domain}
+# part of the {domain}_{variant}.har names written by crawl.py). For every
+# site the requests, third-party domains and cookies of both captures are
+# fingerprinted into sets of 64-bit hashes, and set differences give what
+# disappeared or newly appeared under blocking. Each site is handled once,
+# so the whole run is linear in the size of the corpus.
+
+import argparse
+import hashlib
+import json
+import logging as log
+import multiprocessing
+import os
+import sys
+from urllib.parse import parse_qsl, urlsplit
+
+import tqdm
+
+from domains import hostname, registered_domain
+from har_query import iter_entry_fields
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def site_key(har_path):
+    # ../crawl_data_allow/example.com_allow.har -> example.com
+    return os.path.basename(har_path).rsplit('_', 1)[0]
+
+
+def index_har_files(directory):
+    index = {}
+    with os.scandir(directory) as dir_entries:
+        for dir_entry in dir_entries:
+            if dir_entry.name.endswith('.har') and dir_entry.is_file():
+                index[site_key(dir_entry.name)] = dir_entry.path
+    return index
+
+
+def normalise_url(url):
+    # Lower case scheme and host, no default port or fragment, and only the
+    # names of the query parameters since their values are often cache busters
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = parts.hostname or ''
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        netloc += f':{port}'
+    query = '&'.join(sorted(set(name for name, _value in parse_qsl(parts.query, keep_blank_values=True))))
+    return f'{parts.scheme.lower()}://{netloc}{parts.path or "/"}' + (f'?{query}' if query else '')
+
+
+def fingerprint(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def request_key(fields, granularity):
+    target = normalise_url(fields.url) if granularity == 'url' else registered_domain(fields.url)
+    return f'{fields.method} {fields.resource_type} {target}'
+
+
+def capture_sets(har, first_party, granularity):
+    # {set name: {hash: readable key}} for a single capture
+    requests = {}
+    third_parties = {}
+    cookies = {}
+
+    for fields in iter_entry_fields(har):
+        # Requests that were blocked or failed never reached the network
+        if fields.status == -1:
+            continue
+
+        key = request_key(fields, granularity)
+        requests[fingerprint(key)] = key
+
+        domain = registered_domain(fields.url)
+        if domain and domain != first_party:
+            third_parties[fingerprint(domain)] = domain
+
+        for cookie in fields.response_cookies:
+            cookie_domain = (cookie.get('domain') or hostname(fields.url)).lstrip('.')
+            key = f"{cookie.get('name')}@{cookie_domain}"
+            cookies[fingerprint(key)] = key
+
+    return {'requests': requests, 'third_parties': third_parties, 'cookies': cookies}
+
+
+def diff_sets(allow, block, with_lists):
+    allow_hashes = allow.keys()
+    block_hashes = block.keys()
+    removed = allow_hashes - block_hashes
+    added = block_hashes - allow_hashes
+
+    result = {
+        'added': len(added),
+        'removed': len(removed),
+        'unchanged': len(allow_hashes & block_hashes),
+    }
+    if with_lists:
+        result['added_list'] = sorted(block[h] for h in added)
+        result['removed_list'] = sorted(allow[h] for h in removed)
+    return result
+
+
+def load_har(har_path):
+    with open(har_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def diff_site(job):
+    # Runs in a worker process, returns the diff of one site as a dictionary
+    site, allow_path, block_path, granularity, with_lists = job
+    try:
+        first_party = registered_domain(site) or site
+        allow = capture_sets(load_har(allow_path), first_party, granularity)
+        block = capture_sets(load_har(block_path), first_party, granularity)
+    except Exception as e:
+        return {'site': site, 'error': repr(e)}
+
+    result = {'site': site}
+    for name in ('requests', 'third_parties', 'cookies'):
+        result[name] = diff_sets(allow[name], block[name], with_lists)
+    return result
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Per-site differences between an allow and a block crawl')
+    parser.add_argument('allow_dir', metavar='ALLOW_DIR', help='Crawl directory without blocking')
+    parser.add_argument('block_dir', metavar='BLOCK_DIR', help='Crawl directory with blocking')
+    parser.add_argument('-o', metavar='FILE', help='Output file with one JSON line per site (default: stdout)')
+    parser.add_argument('--granularity', choices=['url', 'domain'], default='url',
+                        help='Fingerprint requests by normalised url or by eTLD+1')
+    parser.add_argument('--counts-only', action='store_true', help='Leave out the lists of added and removed items')
+    parser.add_argument('-j', metavar='N', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG if args.debug else log.INFO)
+
+    return args
+
+
+def main():
+    # python har_diff.py ../crawl_data_allow ../crawl_data_block -o ../analysis/diff.jsonl
+
+    args = parse_arguments()
+
+    allow_index = index_har_files(args.allow_dir)
+    block_index = index_har_files(args.block_dir)
+
+    sites = sorted(allow_index.keys() & block_index.keys())
+    for site in sorted(allow_index.keys() ^ block_index.keys()):
+        log.debug(f"Only one capture for {site}, skipping it")
+    log.info(f"Comparing {len(sites)} sites ({len(allow_index) + len(block_index) - 2 * len(sites)} unmatched)")
+
+    jobs = ((site, allow_index[site], block_index[site], args.granularity, not args.counts_only) for site in sites)
+
+    output = open(args.o, 'w', encoding='utf-8') if args.o else sys.stdout
+    try:
+        with multiprocessing.Pool(max(1, args.j)) as pool:
+            for result in tqdm.tqdm(pool.imap_unordered(diff_site, jobs, chunksize=4), total=len(sites)):
+                if 'error' in result:
+                    log.error(f"Failed to compare {result['site']}: {result['error']}")
+                    continue
+                output.write(json.dumps(result, separators=(',', ':')) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Precompiled field extractors for HAR files.
+#
+# Paths such as '.request.url' are compiled once into plain Python lookups
+# and cached, and entry_fields() reads everything the analyses need from an
+# entry in a single walk over its headers.
+
+import collections
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def compile_path(path):
+    # '.log.entries' -> function(doc, default=None) returning doc['log']['entries']
+    keys = tuple(key for key in path.split('.') if key)
+
+    def extract(doc, default=None):
+        try:
+            for key in keys:
+                doc = doc[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+        return doc
+
+    return extract
+
+
+def query(doc, path, default=None):
+    return compile_path(path)(doc, default)
+
+
+get_entries = compile_path('.log.entries')
+get_pages = compile_path('.log.pages')
+
+
+EntryFields = collections.namedtuple('EntryFields', [
+    'url',
+    'method',
+    'status',
+    'resource_type',
+    'redirect_url',
+    'pageref',
+    'request_has_cookie',
+    'set_cookies',
+    'date',
+    'response_cookies',
+])
+
+
+def entry_fields(entry):
+    # All fields used by the reports, with one pass over the request and response headers
+    request = entry['request']
+    response = entry['response']
+
+    request_has_cookie = False
+    for header in request['headers']:
+        if header['name'].lower() == 'cookie' and header['value']:
+            request_has_cookie = True
+            break
+
+    set_cookies = []
+    date = None
+    for header in response['headers']:
+        name = header['name'].lower()
+        if name == 'set-cookie':
+            # Chromium folds repeated Set-Cookie headers into one value separated by newlines
+            set_cookies.extend(value for value in header['value'].split('\n') if value)
+        elif name == 'date':
+            date = header['value']
+
+    return EntryFields(
+        url=request['url'],
+        method=request.get('method'),
+        status=response.get('status'),
+        resource_type=entry.get('_resourceType'),
+        redirect_url=response.get('redirectURL', ''),
+        pageref=entry.get('pageref'),
+        request_has_cookie=request_has_cookie,
+        set_cookies=set_cookies,
+        date=date,
+        response_cookies=response.get('cookies', []),
+    )
+
+
+def iter_entry_fields(har):
+    for entry in get_entries(har, ()):
+        yield entry_fields(entry)
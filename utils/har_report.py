@@ -0,0 +1,234 @@
+# Per-site JSON report of a HAR file, as described in assignment 1.
+#
+# The report is built in a single pass over the entries: the fields of every
+# entry are extracted once (see har_query) and all counters, domain sets and
+# the per-request list are updated from that.
+#
+# Run as a script it writes a report for every HAR file in the crawl
+# directories of crawl.py, using a pool of worker processes. Every report is
+# written as soon as it is done, so memory use does not grow with the crawl.
+
+import argparse
+import datetime
+import email.utils
+import http.cookies
+import json
+import logging as log
+import multiprocessing
+import os
+
+import tqdm
+
+from domains import hostname, registered_domain
+from entity_resolver import load_entity_resolver
+from har_query import get_entries, iter_entry_fields
+
+SIXTY_DAYS = 60 * 24 * 3600
+
+
+def parse_http_date(value):
+    # Returns an aware datetime, or None if the date cannot be parsed
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def parse_set_cookie(raw_cookie):
+    # Returns the morsel of a Set-Cookie header value, or None if it is malformed
+    cookie = http.cookies.BaseCookie()
+    try:
+        cookie.load(raw_cookie)
+    except http.cookies.CookieError:
+        return None
+    for morsel in cookie.values():
+        return morsel
+    return None
+
+
+def is_tracker_cookie(morsel, response_date):
+    # SameSite=None and a lifetime of at least 60 days (max-age has precedence over expires)
+    if morsel['samesite'].lower() != 'none':
+        return False
+
+    if morsel['max-age']:
+        try:
+            return int(morsel['max-age']) >= SIXTY_DAYS
+        except ValueError:
+            pass
+
+    if morsel['expires']:
+        expire_date = parse_http_date(morsel['expires'])
+        if expire_date is not None:
+            now = response_date or datetime.datetime.now(datetime.timezone.utc)
+            return (expire_date - now).total_seconds() >= SIXTY_DAYS
+
+    return False
+
+
+def get_entityname(resolver, domain):
+    if resolver is not None:
+        entity = resolver.entity_of(domain)
+        if entity is not None:
+            return entity
+    return f'Unknown ({domain})'
+
+
+def compute_report(har, first_party_domain, resolver=None):
+    num_reqs = 0
+    num_requests_w_cookies = 0
+    num_responses_w_cookies = 0
+    third_party_domains = set()
+    tracker_cookie_domains = set()
+    requests = []
+
+    for fields in iter_entry_fields(har):
+        num_reqs += 1
+        domain = registered_domain(fields.url)
+        is_third_party = domain != first_party_domain
+
+        if fields.request_has_cookie:
+            num_requests_w_cookies += 1
+        if fields.set_cookies:
+            num_responses_w_cookies += 1
+        if is_third_party and domain:
+            third_party_domains.add(domain)
+
+        response_date = None
+        for raw_cookie in fields.set_cookies:
+            morsel = parse_set_cookie(raw_cookie)
+            if morsel is None:
+                continue
+            if response_date is None and fields.date:
+                response_date = parse_http_date(fields.date)
+            if is_tracker_cookie(morsel, response_date):
+                cookie_domain = registered_domain(morsel['domain'].lstrip('.')) if morsel['domain'] else domain
+                tracker_cookie_domains.add(cookie_domain or hostname(fields.url))
+
+        requests.append({
+            'url_first_128_char': fields.url[:128],
+            'url_domain': domain,
+            'is_third_party': is_third_party,
+            'set_http_cookies': bool(fields.set_cookies),
+            'entity_name': get_entityname(resolver, domain),
+        })
+
+    third_party_domains = sorted(third_party_domains)
+    return {
+        'num_reqs': num_reqs,
+        'num_requests_w_cookies': num_requests_w_cookies,
+        'num_responses_w_cookies': num_responses_w_cookies,
+        'third_party_domains': third_party_domains,
+        'tracker_cookie_domains': sorted(tracker_cookie_domains),
+        'third_party_entities': sorted(set(get_entityname(resolver, domain) for domain in third_party_domains)),
+        'requests': requests,
+    }
+
+
+def iter_har_files(directories):
+    # Scan lazily, crawl directories can contain many thousands of files
+    for directory in directories:
+        with os.scandir(directory) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith('.har') and dir_entry.is_file():
+                    yield directory, dir_entry.path
+
+
+def first_party_of(har, har_path):
+    # The first entry is the request for the landing page, otherwise use the
+    # {domain}_{variant}.har file name given by crawl.py
+    entries = get_entries(har, ())
+    if entries:
+        domain = registered_domain(entries[0]['request']['url'])
+        if domain:
+            return domain
+    return os.path.basename(har_path).rsplit('_', 1)[0]
+
+
+def report_dir_for(directory, output_dir):
+    # Keep the crawl directory name, so the allow and block reports do not overwrite each other
+    return os.path.join(output_dir, os.path.basename(os.path.normpath(directory)))
+
+
+def report_path_for(har_path, directory, output_dir):
+    name = os.path.splitext(os.path.basename(har_path))[0] + '.json'
+    return os.path.join(report_dir_for(directory, output_dir), name)
+
+
+def write_report(report, report_path, compact):
+    with open(report_path, 'w', encoding='utf-8') as file:
+        if compact:
+            json.dump(report, file, separators=(',', ':'))
+        else:
+            json.dump(report, file, indent=4)
+
+
+def report_har_file(job):
+    # Runs in a worker process, only a small summary is sent back
+    har_path, report_path, domain_map_path, compact = job
+    try:
+        with open(har_path, 'r', encoding='utf-8') as file:
+            har = json.load(file)
+        resolver = load_entity_resolver(domain_map_path) if domain_map_path else None
+        report = compute_report(har, first_party_of(har, har_path), resolver)
+        write_report(report, report_path, compact)
+        return har_path, report['num_reqs'], None
+    except Exception as e:
+        return har_path, 0, repr(e)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate a per-site report for every HAR file of a crawl')
+    parser.add_argument('directories', nargs='+', metavar='DIR', help='Crawl directories containing HAR files')
+    parser.add_argument('-o', metavar='DIR', default='../reports', help='Output directory for the reports')
+    parser.add_argument('--domain-map', metavar='FILE', help='domain_map.json used for the entity names')
+    parser.add_argument('-j', metavar='N', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--compact', action='store_true', help='Write the reports without indentation')
+    parser.add_argument('--skip-existing', action='store_true', help='Do not regenerate reports that already exist')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG if args.debug else log.INFO)
+
+    return args
+
+
+def main():
+    # python har_report.py ../crawl_data_allow ../crawl_data_block -o ../reports --domain-map domain_map.json --compact
+
+    args = parse_arguments()
+
+    for directory in args.directories:
+        os.makedirs(report_dir_for(directory, args.o), exist_ok=True)
+
+    # Build the compact domain map index once here instead of in every worker
+    if args.domain_map:
+        load_entity_resolver(args.domain_map)
+
+    def jobs():
+        for directory, har_path in iter_har_files(args.directories):
+            report_path = report_path_for(har_path, directory, args.o)
+            if args.skip_existing and os.path.exists(report_path):
+                continue
+            yield har_path, report_path, args.domain_map, args.compact
+
+    num_reports = 0
+    num_entries = 0
+    with multiprocessing.Pool(max(1, args.j)) as pool:
+        for har_path, num_reqs, error in tqdm.tqdm(pool.imap_unordered(report_har_file, jobs(), chunksize=4)):
+            if error is not None:
+                log.error(f"Failed to generate report for {har_path}: {error}")
+                continue
+            log.debug(f"Generated report for {har_path} ({num_reqs} requests)")
+            num_reports += 1
+            num_entries += num_reqs
+
+    log.info(f"Generated {num_reports} reports covering {num_entries} requests")
+
+
+if __name__ == '__main__':
+    main()
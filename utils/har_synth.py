@@ -0,0 +1,345 @@
+# Seeded generator of synthetic HAR files, to benchmark the analysis code at
+# sizes the real crawls do not reach.
+#
+# The HAR files look like the ones recorded by crawl.py: a landing page
+# followed by first-party resources, trackers from services.json (popular
+# ones more often) and other third parties. Responses set a variety of
+# cookies, trackers bounce through redirect chains and some responses carry
+# Permissions-Policy, Referrer-Policy and Accept-CH headers. Every site gets
+# its own random generator derived from the seed, so the allow and block
+# variants of a site are the same page, except that tracker requests are
+# aborted in the block variant.
+
+import argparse
+import datetime
+import email.utils
+import json
+import logging as log
+import os
+import random
+
+from har_analysis import SERVICES_PATH
+
+START_DATE = datetime.datetime(2024, 3, 1, tzinfo=datetime.timezone.utc)
+SIXTY_DAYS = 60 * 24 * 3600
+
+TLDS = ['nl', 'com', 'net', 'org', 'io', 'de', 'co.uk']
+WORDS = ['cdn', 'static', 'media', 'fonts', 'api', 'assets', 'img', 'cloud', 'edge', 'widget']
+RESOURCE_TYPES = {
+    'first_party': ['script', 'stylesheet', 'image', 'image', 'font', 'xhr', 'fetch'],
+    'tracker': ['script', 'image', 'ping', 'xhr', 'fetch', 'image'],
+    'other': ['script', 'stylesheet', 'font', 'image', 'fetch'],
+}
+MIME_TYPES = {
+    'document': 'text/html', 'script': 'application/javascript', 'stylesheet': 'text/css',
+    'image': 'image/gif', 'font': 'font/woff2', 'xhr': 'application/json',
+    'fetch': 'application/json', 'ping': 'text/plain',
+}
+PERMISSIONS_POLICIES = [
+    'geolocation=(), camera=(), microphone=()',
+    'geolocation=(self), camera=()',
+    'interest-cohort=()',
+]
+REFERRER_POLICIES = ['no-referrer', 'unsafe-url', 'strict-origin-when-cross-origin', 'same-origin']
+CLIENT_HINTS = ['Sec-CH-UA', 'Sec-CH-UA-Mobile', 'Sec-CH-UA-Platform', 'Sec-CH-UA-Model', 'Device-Memory']
+
+
+def load_tracker_domains(path=SERVICES_PATH):
+    # [(company, domain)] of every domain on the block list
+    with open(path, 'r', encoding='utf-8') as f:
+        blocklist_data = json.load(f)
+
+    trackers = []
+    for category_data in blocklist_data['categories'].values():
+        for entry in category_data:
+            for company_name, domains in entry.items():
+                for _domain, block_domains in domains.items():
+                    if isinstance(block_domains, list):
+                        trackers.extend((company_name, domain) for domain in block_domains)
+
+    return sorted(set(trackers))
+
+
+def http_date(date):
+    return email.utils.format_datetime(date, usegmt=True)
+
+
+def iso_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%S.') + f'{date.microsecond // 1000:03d}Z'
+
+
+class HarGenerator:
+
+    def __init__(self, seed=0, services_path=SERVICES_PATH, num_other_domains=2000):
+        self.seed = seed
+        self.trackers = load_tracker_domains(services_path)
+
+        # Popularity of the trackers follows a Zipf-like distribution
+        rng = random.Random(f'{seed}:domains')
+        rng.shuffle(self.trackers)
+        self.tracker_weights = []
+        total = 0.0
+        for rank in range(len(self.trackers)):
+            total += 1.0 / (rank + 1)
+            self.tracker_weights.append(total)
+
+        self.other_domains = [
+            f'{rng.choice(WORDS)}{i}.{rng.choice(TLDS)}' for i in range(num_other_domains)
+        ]
+
+
+    def site_domain(self, site_index):
+        return f'site{site_index:06d}.{TLDS[site_index % 3]}'
+
+
+    def num_entries(self, site_index, entries_range):
+        # Size of a site, independent of the variant
+        return random.Random(f'{self.seed}:size:{site_index}').randint(*entries_range)
+
+
+    def domain_map(self):
+        # domain_map.json equivalent for the trackers, as used by the assignment 1 scripts
+        return {domain: {'entityName': company} for company, domain in self.trackers}
+
+
+    def cookie(self, rng, domain, date, third_party):
+        # Returns the Set-Cookie header value and the cookie as recorded in the HAR
+        name = rng.choice(['_ga', 'IDE', 'uid', 'sid', 'test_cookie', 'consent', '_fbp', 'visitor'])
+        value = '%016x' % rng.getrandbits(64)
+        parts = [f'{name}={value}', 'Path=/']
+        har_cookie = {'name': name, 'value': value, 'path': '/', 'httpOnly': False, 'secure': False}
+
+        if rng.random() < 0.6:
+            parts.append(f'Domain=.{domain}')
+            har_cookie['domain'] = f'.{domain}'
+
+        lifetime = rng.choice(['session', 'short', 'long', 'long'])
+        seconds = {'session': None, 'short': rng.randrange(60, SIXTY_DAYS), 'long': rng.randrange(SIXTY_DAYS, 2 * 365 * 24 * 3600)}[lifetime]
+        if seconds is not None:
+            expires = date + datetime.timedelta(seconds=seconds)
+            har_cookie['expires'] = iso_date(expires)
+            if rng.random() < 0.5:
+                parts.append(f'Max-Age={seconds}')
+            else:
+                parts.append(f'Expires={http_date(expires)}')
+
+        same_site = rng.choice(['None', 'None', 'Lax', 'Strict', None]) if third_party else rng.choice(['Lax', 'Strict', None])
+        if same_site is not None:
+            parts.append(f'SameSite={same_site}')
+            har_cookie['sameSite'] = same_site
+        if same_site == 'None' or rng.random() < 0.3:
+            parts.append('Secure')
+            har_cookie['secure'] = True
+        if rng.random() < 0.3:
+            parts.append('HttpOnly')
+            har_cookie['httpOnly'] = True
+        if same_site == 'None' and rng.random() < 0.1:
+            parts.append('Partitioned')
+            har_cookie['Partitioned'] = True
+
+        return '; '.join(parts), har_cookie
+
+
+    def entry(self, rng, url, domain, resource_type, date, pageref, *, third_party,
+              blocked=False, redirect_url='', method='GET', site_policies=None):
+        request_headers = [
+            {'name': 'accept', 'value': '*/*'},
+            {'name': 'user-agent', 'value': 'Mozilla/5.0 (X11; Linux x86_64) HeadlessChrome/123.0.0.0'},
+        ]
+        if rng.random() < 0.4:
+            request_headers.append({'name': 'cookie', 'value': f'uid={rng.getrandbits(32):08x}'})
+
+        # The response is always generated, so the random generator advances
+        # the same way for the allow and block variants of a site
+        status = 302 if redirect_url else rng.choice([200] * 18 + [204, 304])
+        headers = [
+            {'name': 'date', 'value': http_date(date)},
+            {'name': 'content-type', 'value': MIME_TYPES[resource_type]},
+        ]
+        if redirect_url:
+            headers.append({'name': 'location', 'value': redirect_url})
+
+        cookies = []
+        num_cookies = 0
+        if rng.random() < (0.35 if third_party else 0.15):
+            num_cookies = rng.choice([1, 1, 1, 2, 3])
+        for _ in range(num_cookies):
+            header_value, har_cookie = self.cookie(rng, domain, date, third_party)
+            headers.append({'name': 'set-cookie', 'value': header_value})
+            cookies.append(har_cookie)
+
+        for name, value in (site_policies or {}).items():
+            headers.append({'name': name, 'value': value})
+
+        size = rng.randrange(40, 200000)
+        time = rng.randrange(5, 900)
+
+        if blocked:
+            # Requests aborted by the block list are recorded without a response
+            response = {
+                'status': -1, 'statusText': '', 'httpVersion': 'HTTP/1.1', 'cookies': [], 'headers': [],
+                'content': {'size': -1, 'mimeType': 'x-unknown'}, 'redirectURL': '',
+                'headersSize': -1, 'bodySize': -1,
+            }
+            time = -1
+        else:
+            response = {
+                'status': status, 'statusText': 'Found' if status == 302 else 'OK', 'httpVersion': 'HTTP/1.1',
+                'cookies': cookies, 'headers': headers,
+                'content': {'size': size, 'mimeType': MIME_TYPES[resource_type]},
+                'redirectURL': redirect_url, 'headersSize': -1, 'bodySize': size,
+            }
+
+        return {
+            'startedDateTime': iso_date(date),
+            'time': time,
+            'pageref': pageref,
+            '_resourceType': resource_type,
+            'request': {
+                'method': method, 'url': url, 'httpVersion': 'HTTP/1.1', 'cookies': [],
+                'headers': request_headers, 'queryString': [], 'headersSize': -1, 'bodySize': 0,
+            },
+            'response': response,
+            'cache': {},
+            'timings': {'send': 0, 'wait': -1, 'receive': -1},
+        }
+
+
+    def random_url(self, rng, domain, resource_type):
+        host = domain if rng.random() < 0.5 else f'{rng.choice(WORDS)}.{domain}'
+        path = '/'.join('%x' % rng.getrandbits(16) for _ in range(rng.randrange(1, 4)))
+        query = f'?v={rng.getrandbits(24)}' if rng.random() < 0.5 else ''
+        return f'https://{host}/{path}.{resource_type}{query}'
+
+
+    def tracker(self, rng):
+        return rng.choices(self.trackers, cum_weights=self.tracker_weights)[0][1]
+
+
+    def generate_har(self, site_index, num_entries, variant='allow'):
+        rng = random.Random(f'{self.seed}:{site_index}')
+        site = self.site_domain(site_index)
+        pageref = 'page@1'
+        date = START_DATE + datetime.timedelta(seconds=rng.randrange(0, 30 * 24 * 3600))
+        blocking = variant == 'block'
+
+        site_policies = {}
+        if rng.random() < 0.3:
+            site_policies['Permissions-Policy'] = rng.choice(PERMISSIONS_POLICIES)
+        if rng.random() < 0.4:
+            site_policies['Referrer-Policy'] = rng.choice(REFERRER_POLICIES)
+        if rng.random() < 0.2:
+            site_policies['Accept-CH'] = ','.join(rng.sample(CLIENT_HINTS, rng.randrange(1, 4)))
+
+        entries = [self.entry(rng, f'https://www.{site}/', site, 'document', date, pageref,
+                              third_party=False, site_policies=site_policies)]
+
+        # Count generated entries rather than recorded ones, a blocked redirect
+        # chain records only its first request but the page stays the same
+        num_generated = 1
+        while num_generated < num_entries:
+            date += datetime.timedelta(milliseconds=rng.randrange(1, 200))
+            kind = rng.choices(['first_party', 'tracker', 'other'], cum_weights=[0.4, 0.75, 1.0])[0]
+            resource_type = rng.choice(RESOURCE_TYPES[kind])
+            method = rng.choices(['GET', 'POST', 'HEAD'], cum_weights=[0.91, 0.99, 1.0])[0]
+
+            if kind == 'tracker' and rng.random() < 0.1:
+                # Cookie syncing: a chain of redirects through other trackers
+                hops = [self.tracker(rng) for _ in range(rng.randrange(2, 6))]
+                urls = [self.random_url(rng, domain, resource_type) for domain in hops]
+                for i, (domain, url) in enumerate(zip(hops, urls)):
+                    if num_generated >= num_entries:
+                        break
+                    redirect_url = urls[i + 1] if i + 1 < len(urls) else ''
+                    entry = self.entry(rng, url, domain, resource_type, date, pageref, third_party=True,
+                                       blocked=blocking, redirect_url=redirect_url, method='GET')
+                    num_generated += 1
+                    # An aborted request does not redirect to the next hop
+                    if not blocking or i == 0:
+                        entries.append(entry)
+                    date += datetime.timedelta(milliseconds=rng.randrange(1, 50))
+                continue
+
+            domain = {'first_party': lambda: site, 'tracker': lambda: self.tracker(rng),
+                      'other': lambda: rng.choice(self.other_domains)}[kind]()
+            entries.append(self.entry(
+                rng, self.random_url(rng, domain, resource_type), domain, resource_type, date, pageref,
+                third_party=kind != 'first_party', blocked=blocking and kind == 'tracker', method=method,
+                site_policies=site_policies if kind == 'first_party' and rng.random() < 0.2 else None,
+            ))
+            num_generated += 1
+
+        return {
+            'log': {
+                'version': '1.2',
+                'creator': {'name': 'har_synth', 'version': '1.0'},
+                'browser': {'name': 'chromium', 'version': '123.0.6312.4'},
+                'pages': [{
+                    'startedDateTime': entries[0]['startedDateTime'],
+                    'id': pageref,
+                    'title': f'https://www.{site}/',
+                    'pageTimings': {'onContentLoad': -1, 'onLoad': -1},
+                }],
+                'entries': entries,
+            }
+        }
+
+
+def parse_entries_range(value):
+    # '500' or '100-5000'
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+def write_corpus(generator, output_dir, num_sites, entries_range, variants):
+    # Writes {output_dir}/crawl_data_{variant}/{domain}_{variant}.har, one file at a time
+    for variant in variants:
+        os.makedirs(os.path.join(output_dir, f'crawl_data_{variant}'), exist_ok=True)
+
+    with open(os.path.join(output_dir, 'domain_map.json'), 'w', encoding='utf-8') as file:
+        json.dump(generator.domain_map(), file)
+
+    num_entries_total = 0
+    for site_index in range(num_sites):
+        num_entries = generator.num_entries(site_index, entries_range)
+        site = generator.site_domain(site_index)
+        for variant in variants:
+            har = generator.generate_har(site_index, num_entries, variant)
+            num_entries_total += len(har['log']['entries'])
+            har_path = os.path.join(output_dir, f'crawl_data_{variant}', f'{site}_{variant}.har')
+            with open(har_path, 'w', encoding='utf-8') as file:
+                json.dump(har, file)
+
+    return num_entries_total
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate synthetic HAR files')
+    parser.add_argument('-o', metavar='DIR', default='../synthetic', help='Output directory')
+    parser.add_argument('--sites', metavar='N', type=int, default=100, help='Number of sites')
+    parser.add_argument('--entries', metavar='MIN[-MAX]', type=parse_entries_range, default=(50, 500),
+                        help='Number of entries per HAR file')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--variants', default='allow,block', help='Comma separated crawl variants')
+
+    args = parser.parse_args()
+
+    log.basicConfig(format='%(levelname)s: %(message)s', level=log.INFO)
+
+    return args
+
+
+def main():
+    # python har_synth.py -o ../synthetic --sites 1000 --entries 100-5000 --seed 1
+
+    args = parse_arguments()
+
+    generator = HarGenerator(args.seed)
+    variants = args.variants.split(',')
+    num_entries = write_corpus(generator, args.o, args.sites, args.entries, variants)
+
+    log.info(f"Generated {args.sites * len(variants)} HAR files with {num_entries} entries in {args.o}")
+
+
+if __name__ == '__main__':
+    main()
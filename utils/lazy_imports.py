@@ -0,0 +1,24 @@
+# Modules that are only imported when one of their attributes is first used.
+#
+# The notebook imports pandas and seaborn like this, so running the analysis
+# without tables or plots (a headless batch job) does not pay for importing them.
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    # The recipe of the importlib documentation, with importlib.util.LazyLoader
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,155 @@
+# Redirect graph of a crawl, with the redirect chains of every page.
+#
+# Built in one pass over the entries of each HAR file. Domains (eTLD+1) are
+# interned to integer ids, edges keep how often a redirect between two
+# domains happened on every site, and the ordered chains of every page are
+# rebuilt by following response.redirectURL from request to request. The
+# chains are indexed by the domains they pass through, so questions such as
+# "which chains involve a tracker" do not need a scan over the whole crawl.
+
+import collections
+from urllib.parse import urljoin
+
+from domains import registered_domain
+from har_query import get_entries
+
+
+class RedirectGraph:
+
+    def __init__(self):
+        self.node_ids = {}  # eTLD+1 -> id
+        self.nodes = []  # id -> eTLD+1
+        self.edges = collections.defaultdict(collections.Counter)  # (source id, target id) -> {site id: count}
+        self.successors = collections.defaultdict(set)
+        self.predecessors = collections.defaultdict(set)
+        self.chain_counts = collections.Counter()  # chain (tuple of ids) -> number of pages
+        self.chain_sites = collections.defaultdict(set)  # chain -> site ids
+        self.chains_by_node = collections.defaultdict(set)
+        self.sites_by_node = collections.defaultdict(set)  # node id -> ids of the sites with a chain through it
+
+
+    def intern(self, domain):
+        node_id = self.node_ids.get(domain)
+        if node_id is None:
+            node_id = self.node_ids[domain] = len(self.nodes)
+            self.nodes.append(domain)
+        return node_id
+
+
+    def add_har(self, har):
+        entries = get_entries(har, ())
+        if not entries:
+            return
+
+        site_id = self.intern(registered_domain(entries[0]['request']['url']))
+
+        # Redirect links per page: url -> url it redirected to
+        links = collections.defaultdict(dict)
+        for entry in entries:
+            redirect_url = entry['response'].get('redirectURL', '')
+            if not redirect_url:
+                continue
+
+            source_url = entry['request']['url']
+            target_url = urljoin(source_url, redirect_url)
+            links[entry.get('pageref')][source_url] = target_url
+
+            source_id = self.intern(registered_domain(source_url))
+            target_id = self.intern(registered_domain(target_url))
+            if source_id != target_id:
+                self.edges[source_id, target_id][site_id] += 1
+                self.successors[source_id].add(target_id)
+                self.predecessors[target_id].add(source_id)
+
+        for page_links in links.values():
+            for chain in self._page_chains(page_links):
+                self.chain_counts[chain] += 1
+                self.chain_sites[chain].add(site_id)
+                for node_id in chain:
+                    self.chains_by_node[node_id].add(chain)
+                    self.sites_by_node[node_id].add(site_id)
+
+
+    def _page_chains(self, page_links):
+        # A chain starts at a url that was not itself the target of a redirect
+        targets = set(page_links.values())
+        for start_url in page_links:
+            if start_url in targets:
+                continue
+
+            chain = [self.intern(registered_domain(start_url))]
+            seen = {start_url}
+            url = page_links[start_url]
+            while url is not None and url not in seen:
+                seen.add(url)
+                node_id = self.intern(registered_domain(url))
+                # Redirects within a domain (http -> https, /a -> /b) are not a hop
+                if node_id != chain[-1]:
+                    chain.append(node_id)
+                url = page_links.get(url)
+
+            if len(chain) > 1:
+                yield tuple(chain)
+
+
+    def _domains(self, chain):
+        return [self.nodes[node_id] for node_id in chain]
+
+
+    def longest_chains(self, n=10):
+        # [(domains of the chain, number of pages)], longest first
+        ranked = sorted(self.chain_counts.items(), key=lambda pair: (len(pair[0]), pair[1]), reverse=True)
+        return [(self._domains(chain), count) for chain, count in ranked[:n]]
+
+
+    def most_common_chains(self, n=10):
+        return [(self._domains(chain), count) for chain, count in self.chain_counts.most_common(n)]
+
+
+    def top_sync_hubs(self, n=10):
+        # [(domain, redirected from, redirected to, sites)]: domains that redirect
+        # between many other domains are likely cookie syncing hubs
+        hubs = []
+        for node_id in self.successors.keys() & self.predecessors.keys():
+            hubs.append((
+                self.nodes[node_id],
+                len(self.predecessors[node_id]),
+                len(self.successors[node_id]),
+                len(self.sites_by_node.get(node_id, ())),
+            ))
+        hubs.sort(key=lambda hub: (hub[1] * hub[2], hub[3]), reverse=True)
+        return hubs[:n]
+
+
+    def chains_involving(self, domains):
+        # [(domains of the chain, number of pages)] of the chains through any of the given domains
+        chains = set()
+        for domain in domains:
+            node_id = self.node_ids.get(domain)
+            if node_id is not None:
+                chains |= self.chains_by_node[node_id]
+        ranked = sorted(chains, key=lambda chain: self.chain_counts[chain], reverse=True)
+        return [(self._domains(chain), self.chain_counts[chain]) for chain in ranked]
+
+
+    def edge_sites(self, source, target):
+        # {site: number of redirects} for the redirects from source to target
+        edge = self.edges.get((self.node_ids.get(source), self.node_ids.get(target)), {})
+        return {self.nodes[site_id]: count for site_id, count in edge.items()}
+
+
+    def to_redirections(self):
+        # source -> target -> {main domains}, the format of analyze_redirections
+        redirections = {}
+        for (source_id, target_id), sites in self.edges.items():
+            redirections.setdefault(self.nodes[source_id], {})[self.nodes[target_id]] = set(
+                self.nodes[site_id] for site_id in sites
+            )
+        return redirections
+
+
+def build_redirect_graph(hars):
+    graph = RedirectGraph()
+    for har in hars:
+        graph.add_har(har)
+    return graph
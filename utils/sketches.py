@@ -0,0 +1,191 @@
+# Fixed-memory sketches for counting over very large crawls.
+#
+# All sketches hash items with a stable 64-bit hash (not Python's salted
+# hash()), so sketches built in different worker processes can be merged.
+#
+# HyperLogLog(p)       distinct count, standard error 1.04 / sqrt(2**p)
+#                      (p=14: 16 KB, ~0.8%; p=10: 1 KB, ~3.3%)
+# SpaceSaving(k)       top-k heavy hitters in k counters. A count is never
+#                      underestimated and at most N / k too high (N = total
+#                      weight added), and every item with a true count above
+#                      N / k is in the summary.
+# CountMinSketch(w, d) point counts in w * d counters. A count is never
+#                      underestimated and, with probability 1 - e**-d, at
+#                      most e / w * N too high.
+
+import hashlib
+import heapq
+import itertools
+import math
+
+
+def stable_hash(item):
+    return int.from_bytes(hashlib.blake2b(str(item).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+
+    def __init__(self, p=14):
+        if not 4 <= p <= 18:
+            raise ValueError("p must be between 4 and 18")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+
+    def add(self, item):
+        h = stable_hash(item)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLogs with a different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+
+    def count(self):
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+
+        # Linear counting is more accurate for small cardinalities
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+    def __len__(self):
+        return self.count()
+
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+
+class SpaceSaving:
+
+    def __init__(self, k=100):
+        self.k = k
+        self.counts = {}  # item -> [count, maximum overestimation]
+        self.total = 0
+        # Min-heap of (count, sequence number, item), one entry per item. An
+        # increment does not touch the heap, so an entry can be lower than the
+        # count of its item; it is fixed when it reaches the top.
+        self._heap = []
+        self._sequence = itertools.count()
+
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counter = self.counts.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counts) < self.k:
+            self.counts[item] = [weight, 0]
+            heapq.heappush(self._heap, (weight, next(self._sequence), item))
+        else:
+            # Replace the smallest counter, the new item may have been counted there
+            minimum = self._pop_min()
+            self.counts[item] = [minimum + weight, minimum]
+            heapq.heappush(self._heap, (minimum + weight, next(self._sequence), item))
+
+
+    def _pop_min(self):
+        # Removes the item with the smallest count and returns its count.
+        # Stale entries are pushed back with their current count, which costs
+        # at most one push per increment, so O(log k) amortised per add.
+        while True:
+            count, _sequence, item = self._heap[0]
+            current = self.counts[item][0]
+            if current == count:
+                heapq.heappop(self._heap)
+                del self.counts[item]
+                return count
+            heapq.heapreplace(self._heap, (current, next(self._sequence), item))
+
+
+    def merge(self, other):
+        # Counts of items missing from a full summary are bounded by its smallest counter
+        own_min = self._min_count()
+        other_min = other._min_count()
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            own = self.counts.get(item, [own_min, own_min])
+            theirs = other.counts.get(item, [other_min, other_min])
+            merged[item] = [own[0] + theirs[0], own[1] + theirs[1]]
+
+        self.k = max(self.k, other.k)
+        self.counts = dict(sorted(merged.items(), key=lambda pair: pair[1][0], reverse=True)[:self.k])
+        self.total += other.total
+        self._heap = [(counter[0], next(self._sequence), item) for item, counter in self.counts.items()]
+        heapq.heapify(self._heap)
+        return self
+
+
+    def _min_count(self):
+        if len(self.counts) < self.k:
+            return 0
+        return min(counter[0] for counter in self.counts.values())
+
+
+    def top(self, n=None):
+        # [(item, count, maximum overestimation)], largest count first
+        ranked = sorted(self.counts.items(), key=lambda pair: pair[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:n]]
+
+
+    def error_bound(self):
+        return self.total / self.k
+
+
+class CountMinSketch:
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+
+    def _columns(self, item):
+        # Double hashing gives the depth independent columns from one 64-bit hash
+        h = stable_hash(item)
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+
+    def add(self, item, weight=1):
+        self.total += weight
+        for row, column in zip(self.table, self._columns(item)):
+            row[column] += weight
+
+
+    def count(self, item):
+        return min(row[column] for row, column in zip(self.table, self._columns(item)))
+
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge Count-Min sketches with a different shape")
+        for row, other_row in zip(self.table, other.table):
+            for column, value in enumerate(other_row):
+                row[column] += value
+        self.total += other.total
+        return self
+
+
+    def error_bound(self):
+        return math.e / self.width * self.total
@@ -0,0 +1,180 @@
+# SQLite store of the crawler statistics, kept across runs.
+#
+# Every run of crawl.py gets a run id and every visit one typed row, for the
+# landing page (depth 0) and for every subpage. The rows are indexed on run,
+# site and variant, so the notebook and dashboards can query a slice of a
+# crawl without loading all of it. load_stats() gives the statistics of one
+# run in the shape of the old stats.json.
+
+import datetime
+import os
+import sqlite3
+import uuid
+from urllib.request import pathname2url
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started TEXT NOT NULL,
+    finished TEXT,
+    command TEXT
+);
+
+CREATE TABLE IF NOT EXISTS visits (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    site TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    url TEXT NOT NULL,
+    page_url TEXT NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0,
+    page_load_time REAL,
+    cache TEXT,
+    consent_click_failure INTEGER NOT NULL DEFAULT 0,
+    page_load_timeout INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (run_id, variant, page_url)
+);
+
+CREATE INDEX IF NOT EXISTS visits_site ON visits (site, variant);
+CREATE INDEX IF NOT EXISTS visits_variant ON visits (variant, run_id);
+'''
+
+# Columns that can be set on a visit, after the key columns
+VISIT_FIELDS = ('page_load_time', 'cache', 'consent_click_failure', 'page_load_timeout', 'error')
+
+VARIANTS = ('allow', 'block')
+
+
+def new_run_id():
+    # Sorts by start time, the suffix keeps runs started in the same second apart
+    return datetime.datetime.now().strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+
+class StatsStore:
+
+    def __init__(self, path, read_only=False):
+        # read_only: open an existing database without changing it, for the
+        # notebook and dashboards. A missing database raises FileNotFoundError.
+        self.path = path
+        if read_only:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No stats database at {path}")
+            self.connection = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro', uri=True)
+            self.connection.row_factory = sqlite3.Row
+            return
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        # Readers (the notebook) do not block the crawler and the other way around
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def start_run(self, command=None, run_id=None):
+        run_id = run_id or new_run_id()
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO runs (run_id, started, command) VALUES (?, ?, ?)',
+                (run_id, datetime.datetime.now().isoformat(), command)
+            )
+        return run_id
+
+
+    def finish_run(self, run_id):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE runs SET finished = ? WHERE run_id = ?', (datetime.datetime.now().isoformat(), run_id)
+            )
+
+
+    def record_visit(self, run_id, site, variant, url, page_url=None, depth=0, **fields):
+        # Inserts the visit or sets the given fields of an earlier row of the
+        # same page, so the outcomes of a visit can be recorded as they happen
+        unknown = fields.keys() - set(VISIT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown visit fields: {', '.join(sorted(unknown))}")
+
+        columns = ['run_id', 'site', 'variant', 'url', 'page_url', 'depth'] + list(fields)
+        values = [run_id, site, variant, url, page_url or url, depth] + list(fields.values())
+        updates = ', '.join(f'{field} = excluded.{field}' for field in fields) or 'depth = excluded.depth'
+        with self.connection:
+            self.connection.execute(
+                f'INSERT INTO visits ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                f'ON CONFLICT (run_id, variant, page_url) DO UPDATE SET {updates}',
+                values
+            )
+
+
+    def runs(self):
+        # Newest first
+        return [dict(row) for row in self.connection.execute('SELECT * FROM runs ORDER BY started DESC')]
+
+
+    def latest_run_id(self):
+        row = self.connection.execute('SELECT run_id FROM runs ORDER BY started DESC LIMIT 1').fetchone()
+        return row['run_id'] if row else None
+
+
+    def visits(self, run_id=None, site=None, variant=None, depth=None):
+        # Rows of the visits as dicts, filtered on the arguments that are not None
+        conditions = []
+        parameters = []
+        for column, value in (('run_id', run_id), ('site', site), ('variant', variant), ('depth', depth)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+
+        sql = 'SELECT * FROM visits'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+
+    def load_stats(self, run_id=None):
+        # The statistics of a run (the latest by default) in the shape of the old stats.json
+        if run_id is None:
+            run_id = self.latest_run_id()
+            if run_id is None:
+                raise ValueError(f"No runs in {self.path}")
+        elif self.connection.execute('SELECT 1 FROM runs WHERE run_id = ?', (run_id,)).fetchone() is None:
+            raise ValueError(f"No run {run_id} in {self.path}")
+
+        stats = {}
+        for variant in VARIANTS:
+            stats['consent_click_failure_' + variant] = []
+            stats['page_load_timeout_' + variant] = []
+            stats['page_load_times_' + variant] = []
+            stats['subpage_load_times_' + variant] = []
+
+        for visit in self.visits(run_id):
+            variant = visit['variant']
+            if visit['depth'] > 0:
+                if visit['page_load_time'] is not None:
+                    stats['subpage_load_times_' + variant].append({
+                        'url': visit['url'], 'subpage_url': visit['page_url'],
+                        'depth': visit['depth'], 'page_load_time': visit['page_load_time']})
+                continue
+
+            if visit['consent_click_failure']:
+                stats['consent_click_failure_' + variant].append(visit['site'])
+            if visit['page_load_timeout']:
+                stats['page_load_timeout_' + variant].append(visit['site'])
+            if visit['page_load_time'] is not None:
+                stats['page_load_times_' + variant].append({
+                    'url': visit['url'], 'page_load_time': visit['page_load_time'], 'cache': visit['cache']})
+
+        return stats
+
+
+def load_run_stats(path, run_id=None):
+    store = StatsStore(path, read_only=True)
+    try:
+        return store.load_stats(run_id)
+    finally:
+        store.close()
@@ -2,9 +2,12 @@
 # webdriver. These are primarily for parsing and searching.
 
 
+import functools
 import random
 import re
 import time
+import weakref
+from collections import namedtuple
 from urllib import parse as urlparse
 
 import domain_utils as du
@@ -41,17 +44,45 @@ def parse_neterror(error_message):
         return error_message
 
 
-def scroll_down(driver):
+# Scrolls by the given amount and calls back once the scroll has settled
+# (or right away if there was nothing to scroll) with whether the bottom of
+# the page is reached.
+SCROLL_STEP_SCRIPT = """
+var callback = arguments[arguments.length - 1];
+var before = window.scrollY;
+var finished = false;
+var settle = null;
+function finish() {
+    if (finished) return;
+    finished = true;
+    window.removeEventListener('scroll', onScroll);
+    callback((window.scrollY + window.innerHeight) + 100 > document.body.clientHeight);
+}
+function onScroll() {
+    clearTimeout(settle);
+    settle = setTimeout(finish, 50);
+}
+window.addEventListener('scroll', onScroll, {passive: true});
+window.scrollBy(0, arguments[0]);
+requestAnimationFrame(function() { if (window.scrollY === before) finish(); });
+setTimeout(finish, 1000);
+"""
+
+
+def scroll_down(driver, pause=False):
+    """Scroll down in random steps until a random stop or the bottom
+
+    Every step is a single script call that returns as soon as the scroll
+    has settled. Set `pause` to also wait 0.5-1.5 seconds after each step,
+    like a human reading the page.
+    """
     at_bottom = False
     while random.random() > 0.20 and not at_bottom:
-        driver.execute_script(
-            "window.scrollBy(0,%d)" % (10 + int(200 * random.random()))
+        at_bottom = driver.execute_async_script(
+            SCROLL_STEP_SCRIPT, 10 + int(200 * random.random())
         )
-        at_bottom = driver.execute_script(
-            "return (((window.scrollY + window.innerHeight ) + 100 "
-            "> document.body.clientHeight ))"
-        )
-        time.sleep(0.5 + random.random())
+        if pause:
+            time.sleep(0.5 + random.random())
 
 
 def scroll_to_bottom(driver):
@@ -66,31 +97,355 @@ def is_loaded(webdriver):
 
 
 def wait_until_loaded(webdriver, timeout, period=0.25, min_time=0):
+    """Wait until `document.readyState` is complete, at most `timeout` seconds
+
+    Waits on the readystatechange event in the page. Polling every `period`
+    seconds is only used for the time that is left if the page navigates
+    away during the wait.
+    """
     start_time = time.time()
     mustend = time.time() + timeout
-    while time.time() < mustend:
-        if is_loaded(webdriver):
-            if time.time() - start_time < min_time:
-                time.sleep(min_time + start_time - time.time())
-            return True
-        time.sleep(period)
-    return False
+    try:
+        loaded = wait_for_ready_state(webdriver, timeout).ready
+    except WebDriverException:
+        loaded = False
+        while time.time() < mustend:
+            if is_loaded(webdriver):
+                loaded = True
+                break
+            time.sleep(period)
+    if loaded and time.time() - start_time < min_time:
+        time.sleep(min_time + start_time - time.time())
+    return loaded
+
+
+# ####### Readiness ########
+Readiness = namedtuple("Readiness", ["ready", "latency"])
+
+# The script timeout of every driver as last read, so that waits do not
+# cost an extra round trip to ask for it
+_script_timeouts = weakref.WeakKeyDictionary()
+
+# Installs a single observer for the condition in the page and calls back
+# with [condition met, seconds waited] when it fires or the timeout passes.
+WAIT_SCRIPT = """
+var condition = arguments[0], timeout = arguments[1] * 1000;
+var by = arguments[2], value = arguments[3];
+var callback = arguments[arguments.length - 1];
+var start = performance.now();
+var done = false, observer = null, timer = null, poller = null;
+
+function find() {
+    switch (by) {
+        case 'css selector': return document.querySelector(value);
+        case 'id': return document.getElementById(value);
+        case 'name': return document.getElementsByName(value)[0] || null;
+        case 'tag name': return document.getElementsByTagName(value)[0] || null;
+        case 'class name': return document.getElementsByClassName(value)[0] || null;
+        case 'xpath': return document.evaluate(value, document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    return null;
+}
+function visible(element) {
+    if (!element || !element.isConnected) return false;
+    var style = window.getComputedStyle(element);
+    return style.visibility !== 'hidden' && style.display !== 'none' &&
+        !!(element.offsetWidth || element.offsetHeight || element.getClientRects().length);
+}
+function met() {
+    switch (condition) {
+        case 'ready': return document.readyState === 'complete';
+        case 'present': return find() !== null;
+        case 'visible': return visible(find());
+        case 'title_is': return document.title === value;
+        case 'title_contains': return document.title.indexOf(value) !== -1;
+    }
+    return false;
+}
+function finish(result) {
+    if (done) return;
+    done = true;
+    if (observer) observer.disconnect();
+    clearTimeout(timer);
+    clearInterval(poller);
+    document.removeEventListener('readystatechange', check);
+    window.removeEventListener('load', check);
+    document.removeEventListener('transitionend', check, true);
+    document.removeEventListener('animationend', check, true);
+    callback([result, (performance.now() - start) / 1000]);
+}
+function check() {
+    if (met()) finish(true);
+}
+
+check();
+if (!done) {
+    if (condition === 'ready') {
+        document.addEventListener('readystatechange', check);
+        window.addEventListener('load', check);
+    } else {
+        observer = new MutationObserver(check);
+        observer.observe(document, {childList: true, subtree: true, attributes: true,
+                                    characterData: true});
+        if (condition === 'visible') {
+            document.addEventListener('transitionend', check, true);
+            document.addEventListener('animationend', check, true);
+            // Style sheets, media queries and reflows change visibility
+            // without a mutation, so also check every 100 ms
+            poller = setInterval(check, 100);
+        }
+    }
+    timer = setTimeout(function() { finish(false); }, timeout);
+}
+"""
+
+# Locator types the in-page observer understands, others fall back to polling
+IN_PAGE_LOCATORS = {
+    By.CSS_SELECTOR,
+    By.ID,
+    By.NAME,
+    By.TAG_NAME,
+    By.CLASS_NAME,
+    By.XPATH,
+}
+
+
+def wait_in_page(driver, condition, timeout, locator_type=None, locator=None):
+    """Wait for a condition with an observer installed in the page
 
+    Parameters
+    ----------
+    driver : selenium.webdriver
+        A Selenium webdriver instance.
+    condition : string
+        One of `ready`, `present`, `visible`, `title_is` and
+        `title_contains`.
+    timeout : float
+        Time in seconds to wait for the condition.
+    locator_type : string, optional
+        `By` locator type of the element for `present` and `visible`.
+    locator : string, optional
+        The locator of the element, or the title for the title conditions.
+
+    Returns
+    -------
+    Readiness
+        Whether the condition was met before `timeout`, and the `latency`
+        in seconds between installing the observer and the condition
+        firing (or the timeout).
+
+    Raises
+    ------
+    WebDriverException
+        Raised if the script could not run, e.g. because the page
+        navigated away during the wait.
+    """
+    # The driver's script timeout is left alone: a wait longer than it is
+    # split into in-page waits that each end before it, so only such long
+    # waits take more than one round trip
+    start_time = time.time()
+    refreshed = False
+    while True:
+        elapsed = time.time() - start_time
+        remaining = max(0, timeout - elapsed)
+        script_timeout = _script_timeout(driver)
+        if script_timeout is None:
+            chunk = remaining
+        else:
+            chunk = min(remaining, max(script_timeout - 1, script_timeout / 2))
 
-def get_intra_links(webdriver, url):
-    ps1 = du.get_ps_plus_1(url)
-    links = list()
-    for elem in webdriver.find_elements(By.TAG_NAME, "a"):
         try:
-            href = elem.get_attribute("href")
-        except StaleElementReferenceException:
+            ready, latency = driver.execute_async_script(
+                WAIT_SCRIPT, condition, chunk, locator_type, locator
+            )
+        except TimeoutException:
+            # The script timeout was lowered since it was read, read it once more
+            if refreshed:
+                return Readiness(False, time.time() - start_time)
+            _script_timeout(driver, refresh=True)
+            refreshed = True
             continue
-        if href is None:
+
+        if ready or chunk >= remaining:
+            return Readiness(ready, elapsed + latency)
+
+
+def _script_timeout(driver, refresh=False):
+    # Script timeout of the driver in seconds, None if it has none
+    if refresh or driver not in _script_timeouts:
+        _script_timeouts[driver] = driver.timeouts.script
+    return _script_timeouts[driver]
+
+
+def _wait_or_poll(driver, wait, timeout, method):
+    # Poll for the time that is left if the page navigated away during the wait
+    start_time = time.time()
+    try:
+        return wait().ready
+    except WebDriverException:
+        remaining = max(0, timeout - (time.time() - start_time))
+        return _wait_with_polling(driver, remaining, method).ready
+
+
+def _wait_with_polling(driver, timeout, method):
+    start_time = time.time()
+    try:
+        WebDriverWait(driver, timeout).until(method)
+        return Readiness(True, time.time() - start_time)
+    except TimeoutException:
+        return Readiness(False, time.time() - start_time)
+
+
+def wait_for_ready_state(driver, timeout=30):
+    return wait_in_page(driver, "ready", timeout)
+
+
+def wait_for_element(driver, locator_type, locator, timeout=3):
+    if locator_type not in IN_PAGE_LOCATORS:
+        return _wait_with_polling(
+            driver, timeout, lambda d: d.find_element(locator_type, locator)
+        )
+    return wait_in_page(driver, "present", timeout, locator_type, locator)
+
+
+def wait_for_visible(driver, locator_type, locator, timeout=3):
+    if locator_type not in IN_PAGE_LOCATORS:
+        return _wait_with_polling(
+            driver, timeout, EC.visibility_of_element_located((locator_type, locator))
+        )
+    return wait_in_page(driver, "visible", timeout, locator_type, locator)
+
+
+def wait_for_title(driver, title, timeout=3, contains=False):
+    condition = "title_contains" if contains else "title_is"
+    return wait_in_page(driver, condition, timeout, None, title)
+
+
+@functools.lru_cache(maxsize=2**16)
+def _ps_plus_1_of_origin(origin):
+    return du.get_ps_plus_1(origin)
+
+
+def get_ps_plus_1(url):
+    """`du.get_ps_plus_1`, memoised on the scheme and host of the url"""
+    parts = urlparse.urlsplit(url)
+    return _ps_plus_1_of_origin("%s://%s" % (parts.scheme, parts.netloc))
+
+
+# Returns the resolved href of every anchor, and of those in same-origin
+# (i)frames when arguments[0] is true.
+LINKS_SCRIPT_BODY = """
+var sameOriginFrames = arguments[0];
+var hrefs = [];
+function collect(doc) {
+    var anchors = doc.getElementsByTagName('a');
+    for (var i = 0; i < anchors.length; i++) {
+        var href = anchors[i].href;
+        if (href && typeof href !== 'string') href = href.animVal;  // SVG links
+        if (href) hrefs.push(href);
+    }
+    if (!sameOriginFrames) return;
+    var frames = doc.querySelectorAll('iframe, frame');
+    for (var j = 0; j < frames.length; j++) {
+        var frameDoc = null;
+        try { frameDoc = frames[j].contentDocument; } catch (e) {}
+        if (frameDoc) collect(frameDoc);
+    }
+}
+collect(document);
+return hrefs;
+"""
+
+
+def get_links(
+    driver,
+    url=None,
+    same_site=None,
+    dedup=True,
+    schemes=("http", "https"),
+    sample=None,
+    seed=None,
+    cross_origin_frames=False,
+):
+    """Get the resolved href of every link on the page in a single script call
+
+    Parameters
+    ----------
+    driver : selenium.webdriver
+        A Selenium webdriver instance.
+    url : string, optional
+        URL of the page, required to filter on `same_site`.
+    same_site : bool, optional
+        `True` keeps only links to the eTLD+1 of `url`, `False` only links
+        to other sites and `None` keeps all links.
+    dedup : bool
+        Drop repeated links, keeping the order of first appearance.
+    schemes : tuple of string or None
+        URL schemes to keep, `None` keeps all of them.
+    sample : int, optional
+        Return a random sample of at most `sample` links.
+    seed : int, optional
+        Seed for the random sample.
+    cross_origin_frames : bool
+        Links inside same-origin frames are always included. Set to `True`
+        to also switch into cross-origin frames, which costs a script call
+        per frame (see `execute_script_in_all_frames`).
+
+    Returns
+    -------
+    list of string
+        The matching links.
+    """
+    if cross_origin_frames:
+        traversal = execute_script_in_all_frames(driver, LINKS_SCRIPT_BODY, False)
+        hrefs = [
+            href for frame in traversal.frames if frame.result for href in frame.result
+        ]
+    else:
+        driver.switch_to.default_content()
+        hrefs = driver.execute_script(LINKS_SCRIPT_BODY, True)
+
+    if dedup:
+        hrefs = list(dict.fromkeys(hrefs))
+
+    if schemes is not None:
+        hrefs = [
+            href for href in hrefs if href.split(":", 1)[0].lower() in schemes
+        ]
+
+    if same_site is not None:
+        ps1 = get_ps_plus_1(url)
+        hrefs = [href for href in hrefs if (get_ps_plus_1(href) == ps1) == same_site]
+
+    if sample is not None and sample < len(hrefs):
+        hrefs = random.Random(seed).sample(hrefs, sample)
+
+    return hrefs
+
+
+def get_intra_links(webdriver, url):
+    """Get the anchor elements that link to the same eTLD+1 as `url`
+
+    The elements and their hrefs come back from a single script call, the
+    eTLD+1 lookups are memoised.
+    """
+    ps1 = get_ps_plus_1(url)
+    links = list()
+    # SVG links have an SVGAnimatedString as href, its animVal is the string
+    anchors = webdriver.execute_script(
+        "return Array.prototype.map.call(document.getElementsByTagName('a'), function(a) {"
+        " if (a.getAttribute('href') === null) return [a, null];"
+        " var href = a.href; if (href && typeof href !== 'string') href = href.animVal;"
+        " return [a, href]; });"
+    )
+    for elem, href in anchors:
+        if not isinstance(href, str):
             continue
         full_href = urlparse.urljoin(url, href)
         if not full_href.startswith("http"):
             continue
-        if du.get_ps_plus_1(full_href) == ps1:
+        if get_ps_plus_1(full_href) == ps1:
             links.append(elem)
     return links
 
@@ -147,10 +502,15 @@ def wait_and_find(driver, locator_type, locator, timeout=3, check_iframes=True):
             iframes = driver.find_elements(By.TAG_NAME, "iframe")
 
             for iframe in iframes:
-                driver.switch_to.default_content()
-                driver.switch_to.frame(iframe)
-                if is_found(driver, locator_type, locator, timeout=0):
-                    return driver.find_element(locator_type, locator)
+                try:
+                    driver.switch_to.frame(iframe)
+                except (StaleElementReferenceException, WebDriverException):
+                    continue
+                elements = driver.find_elements(locator_type, locator)
+                if elements:
+                    return elements[0]
+                # Back up one level directly, instead of walking down from the top again
+                driver.switch_to.parent_frame()
 
             # If we get here, search also fails in iframes
             driver.switch_to.default_content()
@@ -158,39 +518,36 @@ def wait_and_find(driver, locator_type, locator, timeout=3, check_iframes=True):
 
 
 def is_found(driver, locator_type, locator, timeout=3):
-    try:
-        w = WebDriverWait(driver, timeout)
-        w.until(lambda d: d.find_element(locator_type, locator))
-        return True
-    except TimeoutException:
-        return False
+    return _wait_or_poll(
+        driver,
+        lambda: wait_for_element(driver, locator_type, locator, timeout),
+        timeout,
+        lambda d: d.find_element(locator_type, locator),
+    )
 
 
 def is_visible(driver, locator_type, locator, timeout=3):
-    try:
-        w = WebDriverWait(driver, timeout)
-        w.until(EC.visibility_of_element_located((locator_type, locator)))
-        return True
-    except TimeoutException:
-        return False
+    return _wait_or_poll(
+        driver,
+        lambda: wait_for_visible(driver, locator_type, locator, timeout),
+        timeout,
+        EC.visibility_of_element_located((locator_type, locator)),
+    )
 
 
 def title_is(driver, title, timeout=3):
-    try:
-        w = WebDriverWait(driver, timeout)
-        w.until(EC.title_is(title))
-        return True
-    except TimeoutException:
-        return False
+    return _wait_or_poll(
+        driver, lambda: wait_for_title(driver, title, timeout), timeout, EC.title_is(title)
+    )
 
 
 def title_contains(driver, title, timeout=3):
-    try:
-        w = WebDriverWait(driver, timeout)
-        w.until(EC.title_contains(title))
-        return True
-    except TimeoutException:
-        return False
+    return _wait_or_poll(
+        driver,
+        lambda: wait_for_title(driver, title, timeout, contains=True),
+        timeout,
+        EC.title_contains(title),
+    )
 
 
 def is_clickable(driver, full_xpath, xpath, timeout=1):
@@ -281,11 +638,12 @@ def iter_frames(driver):
 def switch_to_parent_frame(driver, frame_stack):
     """Switch driver to parent frame
 
-    Selenium doesn't provide a method to switch up to a parent frame.
     Any frame handles collected in a parent frame can't be used in the
-    child frame, so the only way to switch to a parent frame is to
-    switch back to the top-level frame and then switch back down to the
-    parent through all iframes.
+    child frame, so this switches back to the top-level frame and then
+    back down to the parent through all iframes. That takes one round trip
+    per level; prefer ``driver.switch_to.parent_frame()``, which the frame
+    traversals below use, unless the frame stack has to be re-entered
+    from the top.
 
     Parameters
     ----------
@@ -380,7 +738,105 @@ def execute_in_all_frames(
                 doc_url = driver.execute_script("return window.document.URL;")
                 logger.info("Switched to frame: %s (visit: %d)" % (doc_url, visit_id))
             # Search within child frame
-            execute_in_all_frames(driver, func, kwargs, frame_stack, max_depth)
-            switch_to_parent_frame(driver, frame_stack)
+            try:
+                execute_in_all_frames(
+                    driver, func, kwargs, frame_stack, max_depth, logger, visit_id
+                )
+            finally:
+                driver.switch_to.parent_frame()
         finally:
-            frame_stack.pop()
\ No newline at end of file
+            frame_stack.pop()
+
+
+FrameResult = namedtuple("FrameResult", ["path", "url", "result", "error", "elapsed"])
+FrameTraversal = namedtuple("FrameTraversal", ["frames", "elapsed", "round_trips"])
+
+# Runs the script body in the current frame and returns its result together
+# with the iframes of the frame, so a single round trip per frame is enough.
+# The body is on its own lines, so a trailing // comment cannot swallow the "})"
+FRAME_SCRIPT_WRAPPER = """
+var result = (function() {
+%s
+}).apply(this, arguments);
+return [result, Array.prototype.slice.call(document.getElementsByTagName('iframe')),
+        window.document.URL];
+"""
+
+
+def execute_script_in_all_frames(
+    driver, script, *args, max_depth=5, logger=None, visit_id=-1
+):
+    """Run a JavaScript function body in every reachable frame
+
+    The frame tree is walked depth first, once. The script and the lookup
+    of the child iframes share a single `execute_script` call per frame,
+    and the driver returns to the parent with `switch_to.parent_frame()`,
+    so each frame costs three round trips regardless of its depth.
+
+    >>> traversal = execute_script_in_all_frames(
+    >>>     driver, "return document.links.length;")
+    >>> for frame in traversal.frames:
+    >>>     print(frame.path, frame.url, frame.result)
+
+    Parameters
+    ----------
+    driver : selenium.webdriver
+        A Selenium webdriver instance.
+    script : string
+        Body of a JavaScript function, as given to `execute_script`.
+    args
+        Arguments passed to the script in every frame.
+    max_depth : int
+        Maximum depth to recurse into
+    logger : logger
+        logging module's logger
+    visit_id : int
+        ID of the visit
+
+    Returns
+    -------
+    FrameTraversal
+        `frames` holds a `FrameResult` per frame: the `path` of iframe
+        indices from the top-level frame, the document `url`, the script
+        `result` (or the `error` it raised) and the `elapsed` seconds of
+        the script call. `elapsed` and `round_trips` cover the traversal.
+    """
+    wrapped_script = FRAME_SCRIPT_WRAPPER % script
+    frames = []
+    round_trips = 0
+    start_time = time.time()
+
+    def visit(path):
+        nonlocal round_trips
+        frame_start = time.time()
+        round_trips += 1
+        try:
+            result, iframes, url = driver.execute_script(wrapped_script, *args)
+        except WebDriverException as e:
+            frames.append(FrameResult(path, None, None, e, time.time() - frame_start))
+            return
+        frames.append(FrameResult(path, url, result, None, time.time() - frame_start))
+
+        if len(path) >= max_depth:
+            return
+
+        for index, iframe in enumerate(iframes):
+            round_trips += 1
+            try:
+                driver.switch_to.frame(iframe)
+            except (StaleElementReferenceException, WebDriverException):
+                if logger is not None:
+                    logger.error(
+                        "Error while switching to frame %s (visit: %d))"
+                        % (str(path + (index,)), visit_id)
+                    )
+                continue
+            try:
+                visit(path + (index,))
+            finally:
+                round_trips += 1
+                driver.switch_to.parent_frame()
+
+    driver.switch_to.default_content()
+    visit(())
+    return FrameTraversal(frames, time.time() - start_time, round_trips + 1)
\ No newline at end of file